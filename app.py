@@ -3,20 +3,37 @@
 # app.py – UI + backend Google Sheets (sin Supabase)
 # ---------------------------------------------
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
+import functools
 import io
-from datetime import datetime, date
+import threading
+import time
+from datetime import datetime, date, timedelta
 from typing import Dict, List, Any, Optional
 
 # PDF
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, LongTable
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 
+# Excel
+from openpyxl import Workbook
+
 # Google Sheets
 import gspread
+from gspread.utils import rowcol_to_a1
+
+# Backend alternativo (SQLite local)
+from storage import Storage, abrir_storage, leer_config
+from write_queue import WriteQueue
+from ids import GeneradorIds
+from gobernador import Gobernada, Gobernador
+from vigilante import VigilanteHoja
+import diagnostico
+from diagnostico import medir
 
 # -----------------------------
 # 🎛️ Configuración de la app
@@ -26,6 +43,27 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded"
 )
+# Diagnóstico (oculto): ?diag=1 en la URL o diagnostico = true en secrets muestra
+# el panel; diagnostico_traza = "archivo" guarda cada rerun. Sin nada, no se mide.
+_diag_panel = st.query_params.get("diag") == "1" or leer_config("diagnostico", "false").strip().lower() in ("1", "true", "si", "sí")
+_traza = leer_config("diagnostico_traza", "").strip()
+
+def _cerrar_medicion(medicion: diagnostico.Medicion):
+    """Cierra una medición que no llegó al final del script y la deja para el panel."""
+    medicion.cerrar()
+    if _traza:
+        medicion.volcar(_traza)
+    st.session_state.setdefault("_diag_anteriores", []).append(medicion)
+
+if _diag_panel or _traza:
+    # Un rerun cortado por st.rerun() (después de guardar) no llegó al volcado del final
+    _previa = st.session_state.get("_diag_medicion")
+    if _previa is not None and not _previa.cerrada:
+        _cerrar_medicion(_previa)
+    _medicion = st.session_state["_diag_medicion"] = diagnostico.iniciar()
+else:
+    _medicion = None
+    diagnostico.apagar()
 
 # ============================================================
 # 🔌 BACKEND GOOGLE SHEETS (incluido)
@@ -38,8 +76,15 @@ SCHEMAS: Dict[str, List[str]] = {
     "Citas":     ["id", "fecha", "hora", "cliente_nombre", "barbero", "servicio", "estado"],
     "Ingresos":  ["id", "fecha", "concepto", "monto", "observacion"],
     "Gastos":    ["id", "fecha", "concepto", "monto", "observacion"],
+    # Libro de stock: solo se agregan filas; cantidad > 0 entra, < 0 sale
+    "MovimientosStock": ["id", "fecha", "producto_id", "cantidad", "motivo"],
 }
 
+@st.cache_resource(show_spinner=False)
+def _storage() -> Optional[Storage]:
+    """Backend configurado (st.secrets['storage_backend']); None = Google Sheets."""
+    return abrir_storage(SCHEMAS)
+
 @st.cache_resource(show_spinner=False)
 def _gc():
     sa = st.secrets.get("gcp_service_account")
@@ -50,12 +95,28 @@ def _gc():
         )
     return gspread.service_account_from_dict(dict(sa))
 
+@st.cache_resource(show_spinner=False)
+def _gobernador() -> Gobernador:
+    """Cuota, reintentos y coalescencia para todas las llamadas del proceso (ver gobernador.py)."""
+    return Gobernador(
+        lecturas_por_minuto=float(leer_config("sheets_lecturas_por_minuto", "60")),
+        escrituras_por_minuto=float(leer_config("sheets_escrituras_por_minuto", "60")),
+        observador=diagnostico.observar_api,
+    )
+
 @st.cache_resource(show_spinner=False)
 def _open_sheet():
-    return _gc().open_by_url(SPREADSHEET_URL)
+    # Envuelto: la hoja y las pestañas que se abran desde aquí pasan por el gobernador
+    return Gobernada(_gc(), _gobernador()).open_by_url(SPREADSHEET_URL)
 
+@medir("hoja")
+@st.cache_resource(show_spinner=False)
 def _get_ws(title: str):
-    """Abre/crea hoja y garantiza cabeceras en la fila 1."""
+    """Abre/crea hoja y garantiza cabeceras en la fila 1.
+
+    El handle validado se guarda por proceso; si una lectura detecta cabeceras
+    distintas al esquema se limpia la caché y se vuelve a validar.
+    """
     sh = _open_sheet()
     schema = SCHEMAS[title]
     try:
@@ -74,77 +135,532 @@ def _get_ws(title: str):
         ws.insert_row(schema, 1)
     return ws
 
-def _next_id(ws) -> int:
-    ids = ws.col_values(1)[1:]
-    nums = []
-    for v in ids:
-        try:
-            nums.append(int(str(v).strip()))
-        except:
-            pass
-    return (max(nums) + 1) if nums else 1
+# ---- Copia en memoria compartida por el proceso ----
+# Cada rerun de Streamlit volvía a descargar la hoja completa, y cada pestaña
+# del navegador tenía su propia copia. Guardamos la última lectura por hoja en
+# un solo lugar para todas las sesiones, junto con un índice id -> posición.
+# Las escrituras parchean la entrada en lugar de tirarla; el vigilante
+# (vigilante.py) la descarta cuando la hoja cambia en Drive. Si Drive no
+# responde, las entradas vencen a los CACHE_TTL_SEGUNDOS como antes; con el
+# vigilante al día vencen igual a los CACHE_TTL_VIGILADO_SEGUNDOS, por si un
+# cambio ajeno cayó justo durante una escritura propia (escritura_propia).
+# Cada hoja tiene su lock: una descarga que espera cuota no frena a las demás.
+CACHE_TTL_SEGUNDOS = 60
+CACHE_TTL_VIGILADO_SEGUNDOS = 600
+VIGILANTE_INTERVALO_SEGUNDOS = 15
 
+@st.cache_resource(show_spinner=False)
+def _snapshot() -> Dict[str, Any]:
+    """{"hojas": {sheet: entrada}, "fechas": {sheet: entrada}, "versiones": {sheet: n}, "locks": {sheet: RLock}, "lock": Lock}."""
+    return {"hojas": {}, "fechas": {}, "versiones": {}, "locks": {}, "lock": threading.Lock()}
+
+def _lock_hoja(sheet: str) -> threading.RLock:
+    """Lock de la hoja para descargas, escrituras y parches de su copia en memoria."""
+    snap = _snapshot()
+    with snap["lock"]:
+        return snap["locks"].setdefault(sheet, threading.RLock())
+
+@st.cache_resource(show_spinner=False)
+def _vigilante() -> VigilanteHoja:
+    snap = _snapshot()
+
+    def al_cambiar():
+        # Solo cambios ajenos: las escrituras propias pasan por escritura_propia()
+        for sheet in set(snap["hojas"]) | set(snap["fechas"]):
+            # Espera la descarga en curso de la hoja: no queda guardada una copia vieja
+            with _lock_hoja(sheet):
+                snap["hojas"].pop(sheet, None)
+                snap["fechas"].pop(sheet, None)
+
+    intervalo = float(leer_config("vigilante_segundos", str(VIGILANTE_INTERVALO_SEGUNDOS)))
+    vigilante = VigilanteHoja(_open_sheet().get_lastUpdateTime, al_cambiar, intervalo)
+    vigilante.iniciar()
+    return vigilante
+
+def _cache_hojas() -> Dict[str, Dict[str, Any]]:
+    return _snapshot()["hojas"]
+
+def _fresca(entrada: Optional[Dict[str, Any]]) -> bool:
+    """Con el vigilante al día la entrada vale hasta que la hoja cambie (o el TTL largo); si no, TTL."""
+    if entrada is None:
+        return False
+    ttl = CACHE_TTL_VIGILADO_SEGUNDOS if _vigilante().activo() else CACHE_TTL_SEGUNDOS
+    return time.monotonic() - entrada["ts"] <= ttl
+
+def _invalidar(sheet: str):
+    _cache_hojas().pop(sheet, None)
+
+def _tocar(sheet: str):
+    """Sube la versión local de la hoja: la llaman todas las escrituras de este proceso."""
+    versiones = _snapshot()["versiones"]
+    versiones[sheet] = versiones.get(sheet, 0) + 1
+
+def _version_hojas(*sheets: str) -> str:
+    """Versión barata de los datos de las hojas, para memoizar lo que se arma con ellos.
+
+    Escrituras de este proceso (_tocar) más lo que cambió afuera: la versión del
+    vigilante de Drive o, con SQLite, la del archivo.
+    """
+    versiones = _snapshot()["versiones"]
+    externa = _vigilante().version if _storage() is None else _storage().version()
+    return f"{externa}:" + ",".join(str(versiones.get(s, 0)) for s in sheets)
+
+def _indexar(filas: List[Dict[str, Any]]) -> Dict[int, int]:
+    """id -> posición en `filas` (fila de la hoja = posición + 2). Gana el primero si hay repetidos."""
+    return {r["id"]: pos for pos, r in reversed(list(enumerate(filas))) if isinstance(r.get("id"), int)}
+
+def _entrada(sheet: str) -> Dict[str, Any]:
+    """Devuelve la entrada compartida de la hoja; la descarga si no existe o expiró.
+
+    La descarga ocurre con el lock de la hoja tomado: si varias sesiones la
+    piden a la vez, una sola va a la API y las demás usan el resultado.
+    """
+    with _lock_hoja(sheet):
+        cache = _cache_hojas()
+        entrada = cache.get(sheet)
+        if not _fresca(entrada):
+            filas = _descargar(sheet)
+            if _cola() is not None:
+                filas = _aplicar_pendientes(sheet, filas)
+            ids = _indexar(filas)
+            entrada = {"ts": time.monotonic(), "filas": filas, "ids": ids}
+            cache[sheet] = entrada
+        return entrada
+
+@medir("read_all")
 def _read_all(sheet: str) -> List[Dict[str, Any]]:
-    """Lee registros de forma segura aunque la hoja esté vacía."""
+    """Lee registros desde la copia compartida; descarga la hoja si hace falta."""
+    if _storage() is not None:
+        return _storage().read_all(sheet)
+    # Copias: la UI no debe modificar la copia compartida por accidente
+    with _lock_hoja(sheet):
+        return [dict(r) for r in _entrada(sheet)["filas"]]
+
+@st.cache_resource
+def _ids() -> GeneradorIds:
+    """Generador de ids del proceso, compartido por todas las sesiones."""
+    nodo = leer_config("id_nodo", "").strip()
+    return GeneradorIds(int(nodo) if nodo else None)
+
+def _next_id() -> int:
+    """Id nuevo sin leer la hoja (ver ids.py); no choca entre sesiones concurrentes."""
+    return _ids().siguiente()
+
+# ---- Lecturas por rango de fechas ----
+# Sheets no filtra del lado del servidor: se cachea solo la columna fecha, se
+# ubica el tramo de filas del período (búsqueda binaria si la hoja está en orden
+# cronológico) y se descarga únicamente ese tramo.
+def _invalidar_fechas(sheet: str):
+    _snapshot()["fechas"].pop(sheet, None)
+
+def _columna_fechas(sheet: str) -> pd.Series:
+    """Fechas parseadas de la hoja; el índice es el número de fila."""
+    with _lock_hoja(sheet):
+        cache = _snapshot()["fechas"]
+        entrada = cache.get(sheet)
+        if not _fresca(entrada):
+            valores = _get_ws(sheet).col_values(SCHEMAS[sheet].index("fecha") + 1)[1:]
+            fechas = _fechas(pd.Series(valores, index=range(2, len(valores) + 2), dtype=object))
+            entrada = {"ts": time.monotonic(), "fechas": fechas, "rangos": {}}
+            cache[sheet] = entrada
+        return entrada["fechas"]
+
+RANGOS_POR_HOJA = 8  # períodos distintos recordados por hoja
+
+def _columna_rango(sheet: str, clave: tuple) -> Optional[List[Dict[str, Any]]]:
+    """Registros ya descargados para el período, si la columna fecha sigue vigente."""
+    entrada = _snapshot()["fechas"].get(sheet)
+    if not _fresca(entrada):
+        return None
+    return entrada["rangos"].get(clave)
+
+def _en_rango(filas: List[Dict[str, Any]], desde: date, hasta: date) -> List[Dict[str, Any]]:
+    fechas = _fechas(pd.Series([r.get("fecha", "") for r in filas], dtype=object))
+    dentro = (fechas >= pd.Timestamp(desde)) & (fechas < pd.Timestamp(hasta) + pd.Timedelta(days=1))
+    return [filas[i] for i in dentro[dentro].index]
+
+def _descargar_rango(sheet: str, desde: date, hasta: date) -> List[Dict[str, Any]]:
+    fechas = _columna_fechas(sheet)
+    inicio, fin = pd.Timestamp(desde), pd.Timestamp(hasta) + pd.Timedelta(days=1)
+    if fechas.is_monotonic_increasing:
+        lo, hi = fechas.searchsorted(inicio), fechas.searchsorted(fin)
+        if lo >= hi:
+            return []
+        fila_lo, fila_hi = fechas.index[lo], fechas.index[hi - 1]
+    else:
+        filas = fechas.index[(fechas >= inicio) & (fechas < fin)]
+        if len(filas) == 0:
+            return []
+        fila_lo, fila_hi = filas.min(), filas.max()
+    schema = SCHEMAS[sheet]
+    valores = _get_ws(sheet).get(f"A{fila_lo}:{rowcol_to_a1(fila_hi, len(schema))}")
+    return _registros([schema] + [list(v) + [""] * (len(schema) - len(v)) for v in valores])
+
+@medir("read_rango")
+def _read_rango(sheet: str, desde: date, hasta: date) -> List[Dict[str, Any]]:
+    """Registros con fecha dentro de [desde, hasta] sin descargar toda la hoja."""
+    if _storage() is not None:
+        return _storage().read_range(sheet, str(desde), str(hasta))
+    with _lock_hoja(sheet):
+        entrada = _cache_hojas().get(sheet)
+        if _fresca(entrada):
+            # La hoja completa ya está en memoria: no hace falta ir a la API
+            filas = [dict(r) for r in entrada["filas"]]
+        else:
+            # El tramo descargado se guarda junto a la columna fecha: las
+            # escrituras y el vigilante lo descartan con ella
+            clave = (str(desde), str(hasta))
+            filas = _columna_rango(sheet, clave)
+            if filas is None:
+                filas = _descargar_rango(sheet, desde, hasta)
+                if _cola() is not None:
+                    filas = _aplicar_pendientes(sheet, filas)
+                rangos = _snapshot()["fechas"][sheet]["rangos"]
+                rangos[clave] = filas
+                while len(rangos) > RANGOS_POR_HOJA:
+                    rangos.pop(next(iter(rangos)))
+            filas = [dict(r) for r in filas]
+    return _en_rango(filas, desde, hasta)
+
+@medir("descarga")
+def _descargar(sheet: str) -> List[Dict[str, Any]]:
+    """Lee registros de forma segura aunque la hoja esté vacía (una sola descarga)."""
     ws = _get_ws(sheet)
-    all_vals = ws.get_all_values()
-    if not all_vals or len(all_vals) == 1:
+    valores = ws.get_all_values()
+    if not valores or [h.strip() for h in valores[0]] != SCHEMAS[sheet]:
+        # Alguien tocó las cabeceras desde que se validó el handle
+        _get_ws.clear()
+        ws = _get_ws(sheet)
+        valores = ws.get_all_values()
+    return _registros(valores)
+
+COLUMNAS_NUMERICAS = ("precio", "precio_unitario", "monto", "stock", "cantidad")
+COLUMNAS_ID = ("id", "producto_id")
+
+def _registros(valores: List[List[str]]) -> List[Dict[str, Any]]:
+    """Arma los registros desde la cuadrícula (fila 1 = cabeceras) y normaliza tipos."""
+    if not valores or len(valores) == 1:
         return []
-    rows = ws.get_all_records()
-    # Normaliza tipos
-    for r in rows:
-        if "id" in r and str(r["id"]).strip() != "":
-            try:
-                r["id"] = int(str(r["id"]).strip())
-            except:
-                pass
-        for k in ("precio", "precio_unitario", "monto", "stock"):
-            if k in r and str(r[k]).strip() != "":
-                try:
-                    r[k] = float(str(r[k]).replace(",", "."))
-                except:
-                    pass
-    return rows
-
-def _find_row_by_id(ws, _id: int) -> Optional[int]:
-    vals = ws.col_values(1)
-    for idx, v in enumerate(vals, start=1):
-        if idx == 1:  # cabecera
-            continue
-        try:
-            if int(str(v).strip()) == int(_id):
-                return idx
-        except:
-            continue
-    return None
+    headers = [h.strip() for h in valores[0]]
+    df = pd.DataFrame(valores[1:], columns=headers, dtype=object)
+    df = df.loc[:, [h != "" for h in headers]]
+    # Normaliza tipos por columna (si no convierte, se deja el texto original)
+    for k in COLUMNAS_ID:
+        if k in df.columns:
+            ids = pd.to_numeric(df[k].astype(str).str.strip(), errors="coerce")
+            ok = ids.notna() & (ids % 1 == 0)
+            df.loc[ok, k] = ids[ok].astype("int64")
+    for k in COLUMNAS_NUMERICAS:
+        if k in df.columns:
+            num = pd.to_numeric(df[k].astype(str).str.strip().str.replace(",", ".", regex=False), errors="coerce")
+            df.loc[num.notna(), k] = num[num.notna()]
+    return df.to_dict(orient="records")
+
+def _fechas(valores: pd.Series) -> pd.Series:
+    """Parsea la columna fecha: ISO vectorizado y, solo para lo que no calce, formato libre."""
+    fechas = pd.to_datetime(valores, format="%Y-%m-%d", errors="coerce")
+    resto = fechas.isna() & valores.astype(str).str.strip().ne("")
+    if resto.any():
+        fechas[resto] = pd.to_datetime(valores[resto].astype(str), format="mixed", errors="coerce")
+    return fechas
+
+def _normalizar(sheet: str, values: Dict[str, Any]) -> Dict[str, Any]:
+    """Registro con los mismos tipos que devuelve una lectura de la hoja."""
+    schema = SCHEMAS[sheet]
+    return _registros([schema, [str(values.get(k, "")) for k in schema]])[0]
+
+def _find_row_by_id(sheet: str, _id: int) -> Optional[int]:
+    """Fila de la hoja para el id según el índice; si no está, refresca una vez."""
+    pos = _entrada(sheet)["ids"].get(int(_id))
+    if pos is None:
+        _invalidar(sheet)
+        pos = _entrada(sheet)["ids"].get(int(_id))
+    return None if pos is None else pos + 2
+
+def _filas_confirmadas(sheet: str, ids: List[int]) -> tuple:
+    """Filas de la hoja para los ids, comprobadas contra la columna A antes de escribir.
+
+    La copia en memoria puede tener las posiciones corridas (borrados a mano,
+    otra réplica, la app de clientes). Se lee la celda A de cada fila candidata
+    en una sola llamada; si alguna ya no tiene su id, las posiciones se sacan de
+    nuevo de la columna A y la copia se descarta. Devuelve ({id: fila}, al_dia).
+    """
+    filas = {int(_id): row for _id in ids if (row := _find_row_by_id(sheet, _id))}
+    if not filas or _cola() is not None:
+        # La cola resuelve las filas por id al sincronizar (_sincronizar)
+        return filas, True
+    ws = _get_ws(sheet)
+    celdas = ws.batch_get([f"A{row}" for row in filas.values()])
+    if all(str(c[0][0] if c and c[0] else "").strip() == str(_id) for _id, c in zip(filas, celdas)):
+        return filas, True
+    _invalidar(sheet)
+    _invalidar_fechas(sheet)
+    reales = _filas_en_hoja(ws)
+    return {_id: reales[_id] for _id in filas if _id in reales}, False
 
 def _append(sheet: str, values: Dict[str, Any]):
-    ws = _get_ws(sheet)
-    ordered = [values.get(k, "") for k in SCHEMAS[sheet]]
-    ws.append_row(ordered, value_input_option="USER_ENTERED")
+    _append_many(sheet, [values])
 
-def _update(sheet: str, _id: int, values: Dict[str, Any]):
-    ws = _get_ws(sheet)
-    row = _find_row_by_id(ws, _id)
-    if not row:
+@medir("append")
+def _append_many(sheet: str, lista: List[Dict[str, Any]]):
+    """Agrega varias filas con una sola llamada append_rows (o las encola)."""
+    if not lista:
         return
-    colmap = {name: i+1 for i, name in enumerate(SCHEMAS[sheet])}
-    for k, v in values.items():
-        if k in colmap:
-            ws.update_cell(row, colmap[k], v)
+    _tocar(sheet)
+    if _storage() is not None:
+        return _storage().append_many(sheet, lista)
+    with _lock_hoja(sheet):
+        if _cola() is not None:
+            _cola().encolar(sheet, "append", lista)
+        else:
+            ws = _get_ws(sheet)
+            with _vigilante().escritura_propia():
+                ws.append_rows([_fila_hoja(sheet, values) for values in lista], value_input_option="USER_ENTERED")
+        _invalidar_fechas(sheet)
+        entrada = _cache_hojas().get(sheet)
+        if entrada is not None:
+            for values in lista:
+                registro = _normalizar(sheet, values)
+                entrada["filas"].append(registro)
+                _ajustar_resumen(entrada, sheet, None, registro)
+                if isinstance(registro.get("id"), int):
+                    entrada["ids"].setdefault(registro["id"], len(entrada["filas"]) - 1)
+
+def _reservar_ids(n: int) -> List[int]:
+    """Ids para una carga masiva."""
+    return _ids().bloque(n)
+
+def _fila_hoja(sheet: str, values: Dict[str, Any]) -> List[Any]:
+    """Fila en el orden de SCHEMAS; los ids van como texto (los ids largos no pasan a notación científica)."""
+    fila = [values.get(k, "") for k in SCHEMAS[sheet]]
+    for i, k in enumerate(SCHEMAS[sheet]):
+        if k in COLUMNAS_ID and isinstance(fila[i], int):
+            fila[i] = f"'{fila[i]}"
+    return fila
+
+def _rangos(sheet: str, row: int, values: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Un rango A1 por cada tramo de columnas contiguas (sin reescribir huecos)."""
+    schema = SCHEMAS[sheet]
+    cols = sorted(schema.index(k) + 1 for k in values if k in schema)
+    data, inicio = [], 0
+    for i in range(1, len(cols) + 1):
+        if i == len(cols) or cols[i] != cols[i - 1] + 1:
+            tramo = cols[inicio:i]
+            data.append({
+                "range": f"{rowcol_to_a1(row, tramo[0])}:{rowcol_to_a1(row, tramo[-1])}",
+                "values": [[values[schema[c - 1]] for c in tramo]],
+            })
+            inicio = i
+    return data
 
+def _update(sheet: str, _id: int, values: Dict[str, Any]):
+    _update_many(sheet, {_id: values})
+
+@medir("update")
+def _update_many(sheet: str, cambios: Dict[int, Dict[str, Any]]):
+    """Actualiza varias filas {id: valores} con una sola llamada batch_update (o las encola)."""
+    _tocar(sheet)
+    if _storage() is not None:
+        return _storage().update_many(sheet, cambios)
+    # Con el lock tomado otra sesión no puede correr las filas entre la búsqueda y la escritura
+    with _lock_hoja(sheet):
+        data, filas = [], {}
+        confirmadas, al_dia = _filas_confirmadas(sheet, list(cambios))
+        for _id, values in cambios.items():
+            row = confirmadas.get(int(_id))
+            if not row:
+                continue
+            data += _rangos(sheet, row, values)
+            filas[row] = values
+        if not data:
+            return
+        if _cola() is not None:
+            _cola().encolar(sheet, "update", [{"id": int(_id), "values": values} for _id, values in cambios.items()])
+        else:
+            with _vigilante().escritura_propia():
+                _get_ws(sheet).batch_update(data, value_input_option="USER_ENTERED")
+        _invalidar_fechas(sheet)
+        if not al_dia:
+            return  # la copia se descartó: la próxima lectura la trae de nuevo
+        entrada = _entrada(sheet)
+        cache = entrada["filas"]
+        for row, values in filas.items():
+            nuevo = _normalizar(sheet, {**cache[row - 2], **values})
+            _ajustar_resumen(entrada, sheet, cache[row - 2], nuevo)
+            cache[row - 2] = nuevo
+
+@medir("delete")
 def _delete(sheet: str, _id: int):
+    _tocar(sheet)
+    if _storage() is not None:
+        return _storage().delete(sheet, _id)
+    with _lock_hoja(sheet):
+        confirmadas, al_dia = _filas_confirmadas(sheet, [_id])
+        row = confirmadas.get(int(_id))
+        if row:
+            if _cola() is not None:
+                _cola().encolar(sheet, "delete", [{"id": int(_id)}])
+            else:
+                with _vigilante().escritura_propia():
+                    _get_ws(sheet).delete_rows(row)
+            _invalidar_fechas(sheet)
+            if not al_dia:
+                return
+            # Las filas de abajo suben una posición
+            entrada = _entrada(sheet)
+            pos = row - 2
+            _ajustar_resumen(entrada, sheet, entrada["filas"].pop(pos), None)
+            entrada["ids"] = _indexar(entrada["filas"])
+
+# ---- Resumen diario (rollup) ----
+# Por día (y barbero en Cortes): cantidad de registros y suma del monto. Se arma
+# una vez por descarga de la hoja y cada escritura lo ajusta, así Finanzas y el
+# Reporte suman unos cientos de días en lugar de recorrer todos los movimientos.
+# En MovimientosStock la clave es el producto: la suma de sus días es el stock movido.
+RESUMENES = {"Cortes": ("barbero", "precio"), "Ingresos": (None, "monto"), "Gastos": (None, "monto"),
+             "MovimientosStock": ("producto_id", "cantidad")}
+
+def _construir_resumen(sheet: str, filas: List[Dict[str, Any]]) -> Dict[tuple, List[float]]:
+    campo, monto = RESUMENES[sheet]
+    df = pd.DataFrame(filas)
+    if df.empty:
+        return {}
+    df["dia"] = _fechas(df["fecha"]).dt.date
+    df["valor"] = pd.to_numeric(df[monto], errors="coerce").fillna(0.0)
+    df["clave"] = df[campo].astype(str) if campo else ""
+    g = df.dropna(subset=["dia"]).groupby(["dia", "clave"])["valor"].agg(["size", "sum"])
+    return {k: [int(n), float(t)] for k, (n, t) in zip(g.index, g.values)}
+
+def _ajustar_resumen(entrada: Dict[str, Any], sheet: str, viejo: Optional[Dict[str, Any]], nuevo: Optional[Dict[str, Any]]):
+    """Resta el registro viejo y suma el nuevo en el resumen de la entrada (si ya existe)."""
+    resumen = entrada.get("resumen")
+    if resumen is None:
+        return
+    campo, monto = RESUMENES[sheet]
+    for registro, signo in ((viejo, -1), (nuevo, 1)):
+        if registro is None:
+            continue
+        dia = _fechas(pd.Series([registro.get("fecha", "")], dtype=object)).iloc[0]
+        if pd.isna(dia):
+            continue
+        valor = pd.to_numeric(registro.get(monto), errors="coerce")
+        clave = (dia.date(), str(registro.get(campo, "")) if campo else "")
+        acumulado = resumen.setdefault(clave, [0, 0.0])
+        acumulado[0] += signo
+        acumulado[1] += signo * (0.0 if pd.isna(valor) else float(valor))
+        if acumulado[0] <= 0:
+            resumen.pop(clave)
+
+def _resumen_df(resumen: Dict[tuple, List[float]], desde: Optional[date] = None, hasta: Optional[date] = None) -> pd.DataFrame:
+    df = pd.DataFrame(
+        [(dia, clave, n, t) for (dia, clave), (n, t) in resumen.items()],
+        columns=["fecha", "clave", "cantidad", "total"],
+    )
+    if desde is not None:
+        df = df[(df["fecha"] >= desde) & (df["fecha"] <= hasta)]
+    return df.sort_values("fecha").reset_index(drop=True)
+
+def _resumen_sql(sheet: str, desde: Optional[date] = None, hasta: Optional[date] = None) -> Dict[tuple, List[float]]:
+    """El mismo resumen, sumado por la base (GROUP BY fecha[, clave]) en vez de leer las filas."""
+    campo, monto = RESUMENES[sheet]
+    periodo = () if desde is None else (str(desde), str(hasta))
+    filas = _storage().agregar(sheet, ("fecha", campo) if campo else ("fecha",), monto, *periodo)
+    if not filas:
+        return {}
+    df = pd.DataFrame([(f[0], f[1] if campo else "", f[-2], f[-1]) for f in filas],
+                      columns=["fecha", "clave", "cantidad", "total"])
+    # Fechas en otro formato que AAAA-MM-DD caen en el mismo día al parsearlas
+    df["dia"] = _fechas(df["fecha"]).dt.date
+    g = df.dropna(subset=["dia"]).groupby(["dia", "clave"])[["cantidad", "total"]].sum()
+    return {k: [int(n), float(t)] for k, (n, t) in zip(g.index, g.values)}
+
+def _resumen_diario(sheet: str, desde: Optional[date] = None, hasta: Optional[date] = None) -> pd.DataFrame:
+    """Filas (fecha, clave, cantidad, total) del resumen; opcionalmente solo el período."""
+    if _storage() is not None:
+        return _resumen_df(_resumen_sql(sheet, desde, hasta), desde, hasta)
+    with _lock_hoja(sheet):
+        if desde is not None and not _fresca(_cache_hojas().get(sheet)):
+            # Sin la hoja en memoria sale más barato resumir solo el período
+            return _resumen_df(_construir_resumen(sheet, _read_rango(sheet, desde, hasta)), desde, hasta)
+        entrada = _entrada(sheet)
+        if "resumen" not in entrada:
+            entrada["resumen"] = _construir_resumen(sheet, entrada["filas"])
+        return _resumen_df(entrada["resumen"], desde, hasta)
+
+# ---- Escrituras diferidas (write-behind) ----
+# Con st.secrets['write_behind'] = true las escrituras van a un diario local
+# y un hilo las sincroniza con la hoja en lotes (ver write_queue.py).
+@st.cache_resource(show_spinner=False)
+def _cola() -> Optional[WriteQueue]:
+    """Cola de escrituras diferidas; None = escrituras directas a la hoja."""
+    if _storage() is not None or leer_config("write_behind", "false").strip().lower() not in ("1", "true", "si", "sí"):
+        return None
+    cola = WriteQueue(leer_config("write_queue_path", "cola_escrituras.db"), _sincronizar)
+    cola.iniciar()
+    return cola
+
+def _filas_en_hoja(ws) -> Dict[int, int]:
+    """id -> fila real de la hoja (lo usa el hilo de sincronización)."""
+    filas = {}
+    for idx, v in enumerate(ws.col_values(1), start=1):
+        if idx == 1:  # cabecera
+            continue
+        try:
+            filas.setdefault(int(str(v).strip()), idx)
+        except ValueError:
+            continue
+    return filas
+
+def _sincronizar(sheet: str, op: str, payloads: List[Any], reintento: bool = False):
+    """Escribe en la hoja un tramo de operaciones encoladas, en una sola llamada cuando se puede.
+
+    Updates y deletes buscan las filas por id en cada intento; un append
+    reintentado primero descarta los ids que ya llegaron a la hoja.
+    """
     ws = _get_ws(sheet)
-    row = _find_row_by_id(ws, _id)
-    if row:
-        ws.delete_rows(row)
+    # La copia en memoria ya tiene estas operaciones (_aplicar_pendientes)
+    with _vigilante().escritura_propia():
+        if op == "append":
+            if reintento:
+                ya = _filas_en_hoja(ws)
+                payloads = [p for p in payloads if p.get("id") not in ya]
+                if not payloads:
+                    return
+            ws.append_rows([_fila_hoja(sheet, values) for values in payloads], value_input_option="USER_ENTERED")
+            return
+        filas = _filas_en_hoja(ws)
+        if op == "update":
+            data = []
+            for p in payloads:
+                if p["id"] in filas:
+                    data += _rangos(sheet, filas[p["id"]], p["values"])
+            if data:
+                ws.batch_update(data, value_input_option="USER_ENTERED")
+        elif op == "delete":
+            # De abajo hacia arriba para no correr las filas pendientes
+            for row in sorted((filas[p["id"]] for p in payloads if p["id"] in filas), reverse=True):
+                ws.delete_rows(row)
+
+def _aplicar_pendientes(sheet: str, filas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Superpone a lo descargado las escrituras que aún no llegan a la hoja."""
+    pos = _indexar(filas)
+    for op, payload in _cola().pendientes(sheet):
+        if op == "append" and payload.get("id") not in pos:
+            filas.append(_normalizar(sheet, payload))
+            pos = _indexar(filas)
+        elif op == "update" and payload["id"] in pos:
+            i = pos[payload["id"]]
+            filas[i] = _normalizar(sheet, {**filas[i], **payload["values"]})
+        elif op == "delete" and payload["id"] in pos:
+            filas.pop(pos[payload["id"]])
+            pos = _indexar(filas)
+    return filas
 
 # ---- CRUD específicos que usa la UI ----
 # Cortes
 def insertar_corte(fecha: str, barbero: str, cliente: str, tipo_corte: str, precio: float, observacion: str):
-    ws = _get_ws("Cortes")
     _append("Cortes", {
-        "id": _next_id(ws),
+        "id": _next_id(),
         "fecha": fecha,
         "barbero": barbero,
         "cliente": cliente,
@@ -153,20 +669,34 @@ def insertar_corte(fecha: str, barbero: str, cliente: str, tipo_corte: str, prec
         "observacion": observacion
     })
 
+def insertar_cortes_lote(cortes: List[Dict[str, Any]]):
+    """Inserta muchos cortes (dicts con las columnas de SCHEMAS['Cortes']) en una sola escritura."""
+    ids = _reservar_ids(len(cortes))
+    _append_many("Cortes", [{**c, "id": i} for i, c in zip(ids, cortes)])
+
 def obtener_cortes() -> List[Dict[str, Any]]:
     return _read_all("Cortes")
 
+def obtener_cortes_rango(desde: date, hasta: date) -> List[Dict[str, Any]]:
+    return _read_rango("Cortes", desde, hasta)
+
+def resumen_cortes(desde: Optional[date] = None, hasta: Optional[date] = None) -> pd.DataFrame:
+    return _resumen_diario("Cortes", desde, hasta)
+
 def actualizar_corte(_id: int, values: Dict[str, Any]):
     _update("Cortes", _id, values)
 
+def actualizar_cortes_lote(cambios: Dict[int, Dict[str, Any]]):
+    """{id: valores} para muchos cortes en una sola escritura."""
+    _update_many("Cortes", cambios)
+
 def eliminar_corte(_id: int):
     _delete("Cortes", _id)
 
 # Productos
 def insertar_producto(nombre: str, descripcion: str, stock: int, precio_unitario: float):
-    ws = _get_ws("Productos")
     _append("Productos", {
-        "id": _next_id(ws),
+        "id": _next_id(),
         "nombre": nombre,
         "descripcion": descripcion,
         "stock": stock,
@@ -182,11 +712,53 @@ def actualizar_producto(_id: int, values: Dict[str, Any]):
 def eliminar_producto(_id: int):
     _delete("Productos", _id)
 
+# Stock: el `stock` de Productos es el punto de partida y cada entrada/venta
+# es una fila nueva en MovimientosStock. Dos ventas simultáneas son dos filas,
+# nunca una sobrescribiendo a la otra.
+def registrar_movimientos(deltas: Dict[int, float], motivo: str):
+    """Agrega un movimiento por producto {producto_id: cantidad} en una sola escritura."""
+    hoy = str(date.today())
+    movimientos = [(int(pid), cantidad) for pid, cantidad in deltas.items() if cantidad]
+    ids = _reservar_ids(len(movimientos))
+    _append_many("MovimientosStock", [
+        {"id": _id, "fecha": hoy, "producto_id": pid, "cantidad": cantidad, "motivo": motivo}
+        for _id, (pid, cantidad) in zip(ids, movimientos)
+    ])
+
+def registrar_venta(cantidades: Dict[int, float]):
+    """Descuenta del stock las cantidades vendidas {producto_id: unidades}."""
+    registrar_movimientos({pid: -abs(c) for pid, c in cantidades.items()}, "venta")
+
+def registrar_entrada(cantidades: Dict[int, float]):
+    """Suma al stock las unidades recibidas {producto_id: unidades}."""
+    registrar_movimientos({pid: abs(c) for pid, c in cantidades.items()}, "entrada")
+
+def obtener_movimientos_stock() -> List[Dict[str, Any]]:
+    return _read_all("MovimientosStock")
+
+def stock_actual() -> Dict[int, float]:
+    """Stock vigente por producto: stock base + suma de sus movimientos.
+
+    Sale del resumen de MovimientosStock, que se arma una vez por descarga y
+    cada movimiento nuevo ajusta, así no se recorre el libro completo. Con
+    SQLite la suma por producto la hace la base (GROUP BY producto_id).
+    """
+    df = _tabla(obtener_productos())
+    stock = {} if df.empty else dict(zip(df["id"], df["stock"]))
+    if _storage() is not None:
+        movido = {clave: total for clave, _, total in _storage().agregar("MovimientosStock", ("producto_id",), "cantidad")}
+    else:
+        movido = _resumen_diario("MovimientosStock").groupby("clave")["total"].sum().to_dict()
+    for clave, delta in movido.items():
+        pid = pd.to_numeric(clave, errors="coerce")
+        if pd.notna(pid) and int(pid) in stock:
+            stock[int(pid)] += float(delta)
+    return stock
+
 # Citas
 def insertar_cita(fecha: str, hora: str, cliente_nombre: str, barbero: str, servicio: str):
-    ws = _get_ws("Citas")
     _append("Citas", {
-        "id": _next_id(ws),
+        "id": _next_id(),
         "fecha": fecha,
         "hora": hora,
         "cliente_nombre": cliente_nombre,
@@ -207,14 +779,41 @@ def actualizar_estado_cita(_id: int, nuevo_estado: str):
 def eliminar_cita(_id: int):
     _delete("Citas", _id)
 
+def obtener_citas_filtradas(estado: Optional[str] = None, desde: Optional[date] = None,
+                            hasta: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Citas de la ventana [desde, hasta] (sin límite si falta) y del estado dado (None = todos).
+
+    Con ventana se usa _read_rango, que no baja la hoja completa ni el historial.
+    """
+    if desde is None and hasta is None:
+        citas = _read_all("Citas")
+    else:
+        citas = _read_rango("Citas", desde or date(1900, 1, 1), hasta or date.today() + timedelta(days=3650))
+    if estado is not None:
+        citas = [c for c in citas if c.get("estado") == estado]
+    return citas
+
+def actualizar_estado_citas(ids: List[int], nuevo_estado: str):
+    """Cambia el estado de varias citas en una sola escritura."""
+    _update_many("Citas", {int(_id): {"estado": nuevo_estado} for _id in ids})
+
 # Ingresos / Gastos
 def insertar_ingreso(fecha: str, concepto: str, monto: float, observacion: str):
-    ws = _get_ws("Ingresos")
-    _append("Ingresos", {"id": _next_id(ws), "fecha": fecha, "concepto": concepto, "monto": monto, "observacion": observacion})
+    _append("Ingresos", {"id": _next_id(), "fecha": fecha, "concepto": concepto, "monto": monto, "observacion": observacion})
+
+def insertar_ingresos_lote(ingresos: List[Dict[str, Any]]):
+    ids = _reservar_ids(len(ingresos))
+    _append_many("Ingresos", [{**i, "id": n} for n, i in zip(ids, ingresos)])
 
 def obtener_ingresos() -> List[Dict[str, Any]]:
     return _read_all("Ingresos")
 
+def obtener_ingresos_rango(desde: date, hasta: date) -> List[Dict[str, Any]]:
+    return _read_rango("Ingresos", desde, hasta)
+
+def resumen_ingresos(desde: Optional[date] = None, hasta: Optional[date] = None) -> pd.DataFrame:
+    return _resumen_diario("Ingresos", desde, hasta)
+
 def actualizar_ingreso(_id: int, values: Dict[str, Any]):
     _update("Ingresos", _id, values)
 
@@ -222,18 +821,454 @@ def eliminar_ingreso(_id: int):
     _delete("Ingresos", _id)
 
 def insertar_gasto(fecha: str, concepto: str, monto: float, observacion: str):
-    ws = _get_ws("Gastos")
-    _append("Gastos", {"id": _next_id(ws), "fecha": fecha, "concepto": concepto, "monto": monto, "observacion": observacion})
+    _append("Gastos", {"id": _next_id(), "fecha": fecha, "concepto": concepto, "monto": monto, "observacion": observacion})
+
+def insertar_gastos_lote(gastos: List[Dict[str, Any]]):
+    ids = _reservar_ids(len(gastos))
+    _append_many("Gastos", [{**g, "id": n} for n, g in zip(ids, gastos)])
 
 def obtener_gastos() -> List[Dict[str, Any]]:
     return _read_all("Gastos")
 
+def obtener_gastos_rango(desde: date, hasta: date) -> List[Dict[str, Any]]:
+    return _read_rango("Gastos", desde, hasta)
+
+def resumen_gastos(desde: Optional[date] = None, hasta: Optional[date] = None) -> pd.DataFrame:
+    return _resumen_diario("Gastos", desde, hasta)
+
 def actualizar_gasto(_id: int, values: Dict[str, Any]):
     _update("Gastos", _id, values)
 
 def eliminar_gasto(_id: int):
     _delete("Gastos", _id)
 
+# ============================================================
+# 🧰 Utilidades de UI
+# ============================================================
+TIPOS_CORTE = ["Clásico", "Fade", "Diseño", "Barba", "Otro"]
+COLUMNAS_MONEDA = ("precio", "precio_unitario", "monto")
+_TRADUCE_CRC = str.maketrans(",.", ".,")
+
+def _fmt_crc(valor: float, simbolo: str = "₡") -> str:
+    """1234.5 -> '₡1.234,50' (miles con punto, decimales con coma)."""
+    return f"{simbolo}{valor:,.2f}".translate(_TRADUCE_CRC)
+
+def _fmt_crc_serie(valores: pd.Series, simbolo: str = "₡") -> pd.Series:
+    """Mismo formato que _fmt_crc para una columna completa."""
+    return simbolo + valores.map("{:,.2f}".format).str.translate(_TRADUCE_CRC)
+
+def _norm_horas(horas: pd.Series) -> pd.Series:
+    """Horas a HH:MM ('8:5' -> '08:05', '08:30:00' -> '08:30'), como en clientes_app; lo que no tenga forma H:M queda igual."""
+    horas = horas.astype(str).str.strip()
+    partes = horas.str.extract(r"^(\d{1,2}):(\d{1,2})(?::\d{1,2})?$")
+    return (partes[0].str.zfill(2) + ":" + partes[1].str.zfill(2)).fillna(horas)
+
+def _tabla(registros: List[Dict[str, Any]]) -> pd.DataFrame:
+    """DataFrame tipado una sola vez por pestaña.
+
+    Normaliza `hora` a HH:MM, agrega `fecha_dt` (datetime) y `fecha_txt` (dd/mm/aaaa), deja los montos y el
+    stock como números (vacío -> 0) y agrega `<monto>_txt` ya formateado en colones.
+    """
+    df = pd.DataFrame(registros)
+    if df.empty:
+        return df
+    if "hora" in df.columns:
+        df["hora"] = _norm_horas(df["hora"])
+    if "fecha" in df.columns:
+        df["fecha_dt"] = _fechas(df["fecha"])
+        df["fecha_txt"] = df["fecha_dt"].dt.strftime("%d/%m/%Y").fillna(df["fecha"].astype(str))
+    for k in COLUMNAS_NUMERICAS:
+        if k in df.columns:
+            df[k] = pd.to_numeric(df[k], errors="coerce").fillna(0.0)
+            if k in COLUMNAS_MONEDA:
+                df[f"{k}_txt"] = _fmt_crc_serie(df[k])
+    return df
+
+def _valor_celda(v: Any) -> Any:
+    """Valor listo para la hoja: fechas AAAA-MM-DD, vacíos como "", numpy -> Python."""
+    if v is None or (pd.api.types.is_scalar(v) and pd.isna(v)):
+        return ""
+    if isinstance(v, (date, datetime)):
+        return v.strftime("%Y-%m-%d")
+    if hasattr(v, "item"):
+        return v.item()
+    return v
+
+def _diferencias(original: pd.DataFrame, editado: pd.DataFrame) -> Dict[int, Dict[str, Any]]:
+    """{id: {columna: valor}} con solo las celdas que cambiaron en un st.data_editor."""
+    iguales = (original == editado) | (original.isna() & editado.isna())
+    cambios = {}
+    for i in iguales.index[~iguales.all(axis=1)]:
+        cols = iguales.columns[~iguales.loc[i]]
+        cambios[int(original.at[i, "id"])] = {c: _valor_celda(editado.at[i, c]) for c in cols}
+    return cambios
+
+FORMATOS_EXPORTACION = {
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": ("csv", "text/csv"),
+}
+
+@medir("exportar", "respaldo")
+@st.cache_data(max_entries=8, show_spinner=False)
+def _exportar(version: str, formato: str, hoja: str, _df: pd.DataFrame) -> bytes:
+    """Archivo de respaldo memoizado por (versión, formato, hoja); el DataFrame no se hashea.
+
+    El Excel se escribe con un libro openpyxl en modo write_only, que va volcando
+    las filas en lugar de armar una celda Python por cada valor.
+    """
+    if formato == "CSV":
+        return _df.to_csv(index=False).encode("utf-8-sig")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(hoja)
+    ws.append([str(c) for c in _df.columns])
+    for fila in _df.itertuples(index=False, name=None):
+        ws.append(fila)
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+def _boton_exportar(df: pd.DataFrame, etiqueta: str, archivo: str, hoja: str, clave: str, version: str):
+    """Genera el respaldo solo cuando se pide y lo reutiliza mientras `version` no cambie."""
+    c1, c2 = st.columns([1, 3])
+    formato = c1.radio("Formato", list(FORMATOS_EXPORTACION), horizontal=True, key=f"formato_{clave}", label_visibility="collapsed")
+    if c2.button(f"🧾 Preparar {etiqueta.lower()}", key=f"preparar_{clave}"):
+        st.session_state[f"pedido_{clave}"] = version
+    if st.session_state.get(f"pedido_{clave}") == version:
+        extension, mime = FORMATOS_EXPORTACION[formato]
+        with st.spinner("Generando archivo..."):
+            datos = _exportar(version, formato, hoja, df)
+        st.download_button(f"⬇️ Descargar {etiqueta.lower()} ({formato})", datos, f"{archivo}.{extension}", mime, key=f"descargar_{clave}")
+
+def _libro_movimientos(df_ing: pd.DataFrame, df_gas: pd.DataFrame) -> pd.DataFrame:
+    """Ingresos y gastos en un solo libro ordenado por fecha, con el saldo acumulado.
+
+    `hoja` dice de dónde viene cada fila, `signo` vale +monto o -monto y `saldo`
+    es su suma acumulada (cumsum) desde el primer movimiento.
+    """
+    partes = [df.assign(hoja=hoja, signo=df["monto"] * factor)
+              for hoja, df, factor in (("Ingresos", df_ing, 1), ("Gastos", df_gas, -1)) if not df.empty]
+    if not partes:
+        return pd.DataFrame()
+    libro = pd.concat(partes, ignore_index=True).sort_values(["fecha_dt", "id"], kind="stable", na_position="first")
+    libro["saldo"] = libro["signo"].cumsum()
+    libro["saldo_txt"] = _fmt_crc_serie(libro["saldo"])
+    return libro
+
+# ============================================================
+# 🧩 Filas en fragmentos
+# ============================================================
+# Cada fila de las listas es un st.fragment: ✏️/❌/💾/🗑️ vuelven a ejecutar
+# solo esa fila, no todo el script. La fila editada se guarda en la sesión
+# (_fila_<hoja>_<id>) para redibujarla sin releer la lista; el siguiente rerun
+# completo descarta esos parches y dibuja desde la copia compartida, que las
+# escrituras ya dejaron al día.
+def _fila_vigente(sheet: str, fila: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """La fila parcheada en esta sesión (None = eliminada) o la del último rerun completo."""
+    return st.session_state.get(f"_fila_{sheet}_{int(fila['id'])}", fila)
+
+def _parchear_fila(sheet: str, fila: Dict[str, Any], values: Optional[Dict[str, Any]]):
+    """Aplica `values` a la fila (None = eliminada) para el próximo rerun del fragmento."""
+    clave = f"_fila_{sheet}_{int(fila['id'])}"
+    if values is None:
+        st.session_state[clave] = None
+    else:
+        st.session_state[clave] = _tabla([{**{k: fila.get(k, "") for k in SCHEMAS[sheet]}, **values}]).to_dict(orient="records")[0]
+
+def _descartar_parches():
+    """Al empezar un rerun completo las filas vuelven a salir de la copia compartida."""
+    for clave in [k for k in st.session_state if str(k).startswith("_fila_")]:
+        del st.session_state[clave]
+
+def _medir_fragmento(fn):
+    """Medición propia para el rerun de un fragmento (el inicio del script no corre).
+
+    Dentro de un rerun completo los eventos van a la medición del rerun; si el
+    fragmento se redibuja solo, se abre una aquí, se vuelca a la traza al
+    terminar y el panel la muestra en el próximo rerun completo.
+    """
+    @functools.wraps(fn)
+    def envoltura(*args, **kwargs):
+        abierta = diagnostico.actual()
+        if not (_diag_panel or _traza) or (abierta is not None and not abierta.cerrada):
+            return fn(*args, **kwargs)
+        medicion = diagnostico.iniciar(f"{menu} · {fn.__name__}")
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _cerrar_medicion(medicion)
+    return envoltura
+
+def _rerun_fila():
+    """Redibuja solo el fragmento; si el clic llegó en un rerun completo, rerun completo."""
+    # La escritura de esta sesión ya está en la fila: no hace falta redibujar todo por ella
+    st.session_state["_version_vista"] = _version_hojas(*SCHEMAS)
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+@st.fragment
+@_medir_fragmento
+def _fila_corte(corte: Dict[str, Any]):
+    corte = _fila_vigente("Cortes", corte)
+    if corte is None:
+        return
+    id_corte = int(corte["id"])
+    if st.session_state.get(f"editando_corte_{id_corte}", False):
+        st.markdown(f"### ✏️ Editando corte ID {id_corte}")
+        f = st.date_input("Fecha", value=corte["fecha_dt"], key=f"fecha_{id_corte}")
+        b = st.text_input("Barbero", value=corte["barbero"], key=f"barbero_{id_corte}")
+        c = st.text_input("Cliente", value=corte["cliente"], key=f"cliente_{id_corte}")
+        try:
+            idx = TIPOS_CORTE.index(corte["tipo_corte"])
+        except:
+            idx = 0
+        t = st.selectbox("Tipo de corte", TIPOS_CORTE, index=idx, key=f"tipo_{id_corte}")
+        p = st.number_input("Precio (₡)", value=float(corte["precio"]), step=500.0, format="%.2f", key=f"precio_{id_corte}")
+        o = st.text_area("Observación", value=corte.get("observacion") or "", key=f"obs_{id_corte}")
+
+        col1, col2 = st.columns(2)
+        if col1.button("💾 Guardar", key=f"guardar_{id_corte}"):
+            values = {"fecha": str(f), "barbero": b, "cliente": c, "tipo_corte": t, "precio": p, "observacion": o}
+            actualizar_corte(id_corte, values)
+            _parchear_fila("Cortes", corte, values)
+            st.session_state[f"editando_corte_{id_corte}"] = False
+            st.toast("✅ Corte actualizado")
+            _rerun_fila()
+        if col2.button("❌ Cancelar", key=f"cancelar_{id_corte}"):
+            st.session_state[f"editando_corte_{id_corte}"] = False
+            _rerun_fila()
+    else:
+        cols = st.columns([1.5, 2, 2, 2, 1.5, 3, 1, 1])
+        cols[0].markdown(f"🗓️ **{corte['fecha_txt']}**")
+        cols[1].markdown(f"💈 **{corte['barbero']}**")
+        cols[2].markdown(f"👤 {corte['cliente']}")
+        cols[3].markdown(f"✂️ {corte['tipo_corte']}")
+        cols[4].markdown(f"💰 {corte['precio_txt']}")
+        cols[5].markdown(f"📝 {corte.get('observacion') or '—'}")
+        if cols[6].button("✏️", key=f"edit_{id_corte}"):
+            st.session_state[f"editando_corte_{id_corte}"] = True
+            _rerun_fila()
+        if cols[7].button("🗑️", key=f"delete_{id_corte}"):
+            eliminar_corte(id_corte)
+            _parchear_fila("Cortes", corte, None)
+            st.toast("✅ Corte eliminado")
+            _rerun_fila()
+
+@st.fragment
+@_medir_fragmento
+def _fila_producto(producto: Dict[str, Any]):
+    producto = _fila_vigente("Productos", producto)
+    if producto is None:
+        return
+    idp = int(producto["id"])
+    if st.session_state.get(f"edit_prod_{idp}", False):
+        st.markdown(f"### ✏️ Editando producto ID {idp}")
+        col1, col2 = st.columns(2)
+        nombre_edit = col1.text_input("Nombre", value=producto["nombre"], key=f"nombre_{idp}")
+        precio_edit = col2.number_input("Precio (₡)", value=float(producto["precio_unitario"]), step=100.0, format="%.2f", key=f"precio_{idp}")
+        descripcion_edit = st.text_input("Descripción", value=producto.get("descripcion") or "", key=f"desc_{idp}")
+        ajuste = st.number_input(f"Ajuste de stock (actual: {int(producto['stock'])})", value=0, step=1, key=f"stock_{idp}")
+        col1b, col2b = st.columns(2)
+        if col1b.button("💾 Guardar", key=f"guardar_{idp}"):
+            values = {"nombre": nombre_edit, "precio_unitario": precio_edit, "descripcion": descripcion_edit}
+            actualizar_producto(idp, values)
+            if ajuste:
+                registrar_movimientos({idp: ajuste}, "ajuste")
+            _parchear_fila("Productos", producto, {**values, "stock": producto["stock"] + ajuste})
+            st.session_state[f"edit_prod_{idp}"] = False
+            st.toast("✅ Producto actualizado")
+            _rerun_fila()
+        if col2b.button("❌ Cancelar", key=f"cancelar_{idp}"):
+            st.session_state[f"edit_prod_{idp}"] = False
+            _rerun_fila()
+    else:
+        cols = st.columns([2, 2, 2, 2, 1, 1])
+        cols[0].markdown(f"📦 **{producto['nombre']}**")
+        cols[1].markdown(f"🧾 {producto.get('descripcion') or '—'}")
+        cols[2].markdown(f"💰 {producto['precio_unitario_txt']}")
+        cols[3].markdown(f"📦 Stock: {int(producto['stock'])}")
+        if cols[4].button("✏️", key=f"edit_{idp}"):
+            st.session_state[f"edit_prod_{idp}"] = True
+            _rerun_fila()
+        if cols[5].button("🗑️", key=f"del_{idp}"):
+            eliminar_producto(idp)
+            _parchear_fila("Productos", producto, None)
+            st.toast("✅ Producto eliminado")
+            _rerun_fila()
+
+@st.fragment
+@_medir_fragmento
+def _tarjeta_cita(cita: Dict[str, Any], estado_filtro: str):
+    cita = _fila_vigente("Citas", cita)
+    # Si cambió de estado y ya no calza con el filtro, desaparece de la lista
+    if cita is None or (estado_filtro != "todas" and cita["estado"] != estado_filtro):
+        return
+    cid = int(cita["id"])
+    st.markdown(f"### 🧾 Cita ID {cid}")
+    col1, col2, col3 = st.columns(3)
+    col1.markdown(f"**📅 Fecha:** {cita['fecha_txt']}")
+    col2.markdown(f"**🕒 Hora:** {cita['hora']}")
+    col3.markdown(f"**🧴 Servicio:** {cita['servicio']}")
+    st.markdown(f"**👤 Cliente:** {cita['cliente_nombre']}")
+    st.markdown(f"**✂️ Barbero asignado:** {cita.get('barbero') or 'Sin asignar'}")
+    st.markdown(f"**📌 Estado actual:** `{cita['estado']}`")
+
+    with st.expander("✏️ Editar cita"):
+        # Fecha
+        valor_fecha = cita["fecha_dt"].date() if pd.notna(cita["fecha_dt"]) else date.today()
+        nueva_fecha = st.date_input("📅 Nueva fecha", value=valor_fecha, key=f"fecha_{cid}")
+        # Hora
+        try:
+            hora_original = datetime.strptime(cita["hora"], "%H:%M").time()
+        except:
+            try:
+                hora_original = datetime.strptime(cita["hora"], "%H:%M:%S").time()
+            except:
+                hora_original = datetime.strptime("08:00", "%H:%M").time()
+        nueva_hora = st.time_input("🕒 Nueva hora", value=hora_original, key=f"hora_{cid}")
+        nuevo_barbero = st.text_input("✂️ Asignar barbero", value=cita.get("barbero") or "", key=f"barbero_{cid}")
+
+        col_e1, col_e2 = st.columns(2)
+        if col_e1.button("💾 Guardar cambios", key=f"guardar_cita_{cid}"):
+            values = {"fecha": nueva_fecha.strftime("%Y-%m-%d"), "hora": nueva_hora.strftime("%H:%M"), "barbero": nuevo_barbero}
+            actualizar_cita(cid, values)
+            _parchear_fila("Citas", cita, values)
+            st.toast("✅ Cita actualizada")
+            _rerun_fila()
+        if col_e2.button("🗑️ Eliminar cita", key=f"eliminar_cita_{cid}"):
+            eliminar_cita(cid)
+            _parchear_fila("Citas", cita, None)
+            st.toast("✅ Cita eliminada")
+            _rerun_fila()
+
+    col_a1, col_a2 = st.columns(2)
+    if cita["estado"] == "pendiente":
+        if col_a1.button("✅ Aceptar", key=f"aceptar_{cid}"):
+            actualizar_estado_cita(cid, "aceptada")
+            _parchear_fila("Citas", cita, {"estado": "aceptada"})
+            st.toast("📬 Cita aceptada")
+            _rerun_fila()
+        if col_a2.button("❌ Rechazar", key=f"rechazar_{cid}"):
+            actualizar_estado_cita(cid, "rechazada")
+            _parchear_fila("Citas", cita, {"estado": "rechazada"})
+            st.toast("📭 Cita rechazada")
+            _rerun_fila()
+
+@st.fragment
+@_medir_fragmento
+def _fila_movimiento(sheet: str, mov: Dict[str, Any]):
+    """Ingreso o gasto. ✏️/❌ redibujan solo la fila; 💾/🗑️ rerun completo para que cuadren los totales."""
+    ingreso = sheet == "Ingresos"
+    p, flag = ("i", "edit_ingreso") if ingreso else ("g", "edit_gasto")
+    _id = int(mov["id"])
+    if st.session_state.get(f"{flag}_{_id}"):
+        st.markdown(f"#### ✏️ Editando {'ingreso' if ingreso else 'gasto'} ID {_id}")
+        f = st.date_input("Fecha", value=mov["fecha_dt"], key=f"fecha_{p}_{_id}")
+        c = st.text_input("Concepto", value=mov["concepto"], key=f"concepto_{p}_{_id}")
+        m = st.number_input("Monto (₡)", value=float(mov["monto"]), key=f"monto_{p}_{_id}", step=500.0)
+        o = st.text_input("Observación", value=mov.get("observacion") or "", key=f"obs_{p}_{_id}")
+        cc1, cc2 = st.columns(2)
+        if cc1.button("💾 Guardar", key=f"guardar_{p}_{_id}"):
+            actualizar = actualizar_ingreso if ingreso else actualizar_gasto
+            actualizar(_id, {"fecha": str(f), "concepto": c, "monto": m, "observacion": o})
+            st.session_state[f"{flag}_{_id}"] = False; st.rerun()
+        if cc2.button("❌ Cancelar", key=f"cancelar_{p}_{_id}"):
+            st.session_state[f"{flag}_{_id}"] = False; _rerun_fila()
+    else:
+        saldo = f" | 🧾 Saldo: {mov['saldo_txt']}" if "saldo_txt" in mov else ""
+        st.markdown(f"📅 {mov['fecha_txt']} | {'💰' if ingreso else '💸'} {mov['monto_txt']} | 📄 {mov['concepto']}{saldo}")
+        st.markdown(f"📝 {mov.get('observacion') or '—'}")
+        c1, c2 = st.columns(2)
+        if c1.button("✏️ Editar", key=f"editar_{p}_{_id}"):
+            st.session_state[f"{flag}_{_id}"] = True; _rerun_fila()
+        if c2.button("🗑️ Eliminar", key=f"eliminar_{p}_{_id}"):
+            (eliminar_ingreso if ingreso else eliminar_gasto)(_id); st.rerun()
+
+# ============================================================
+# 📄 Informe PDF
+# ============================================================
+PDF_FILAS_POR_TABLA = 400
+
+@medir("pdf", "informe")
+@st.cache_data(max_entries=8, show_spinner=False)
+def _informe_pdf(fecha_inicio: date, fecha_fin: date, version: str, _df_ingresos: pd.DataFrame,
+                 _df_gastos: pd.DataFrame, total_ingresos: float, total_gastos: float) -> bytes:
+    """PDF del período. Memoizado por (período, versión): los DataFrames no se hashean.
+
+    Las tablas largas se parten en LongTable de PDF_FILAS_POR_TABLA filas con el
+    encabezado repetido en cada página, en lugar de una sola Table gigante.
+    """
+    df_ingresos, df_gastos = _df_ingresos, _df_gastos
+    balance = (total_ingresos or 0) - (total_gastos or 0)
+    pdf_buffer = io.BytesIO()
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=A4, leftMargin=2*cm, rightMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
+    styles = getSampleStyleSheet()
+    elements = []
+
+    style_title = ParagraphStyle("title", fontSize=16, alignment=1, textColor=colors.white, backColor=colors.HexColor("#007bff"), spaceAfter=12, spaceBefore=6, leading=20)
+    style_section_title = ParagraphStyle("section", fontSize=12, textColor=colors.white, leftIndent=0, spaceBefore=12, spaceAfter=6, leading=14)
+    style_normal = styles["Normal"]; style_normal.spaceAfter = 6
+
+    def color_box(text, bgcolor):
+        return Table([[Paragraph(text, style_section_title)]], colWidths=[doc.width], style=[
+            ("BACKGROUND", (0, 0), (-1, -1), bgcolor),
+            ("LEFTPADDING", (0, 0), (-1, -1), 6),
+            ("TOPPADDING", (0, 0), (-1, -1), 4),
+            ("BOTTOMPADDING", (0, 0), (-1, -1), 4)
+        ])
+
+    def crear_tablas(df, headers):
+        filas = df[["fecha", "concepto", "monto"]].astype(str).values.tolist()
+        for i in range(0, len(filas), PDF_FILAS_POR_TABLA):
+            yield LongTable([headers] + filas[i:i + PDF_FILAS_POR_TABLA], repeatRows=1, style=[
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#e8e8e8")),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+                ('FONTSIZE', (0, 0), (-1, -1), 9),
+                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ], hAlign='LEFT')
+
+    elements.append(Paragraph("Informe Financiero", style_title))
+    elements.append(Paragraph("Este informe fue generado automáticamente por la Barbería [Nombre de la Barbería].", style_normal))
+    elements.append(Paragraph(f"<i>Período: {fecha_inicio.strftime('%d-%m-%Y')} al {fecha_fin.strftime('%d-%m-%Y')}</i>", style_normal))
+
+    # Ingresos
+    if not df_ingresos.empty:
+        elements.append(color_box("Ingresos", colors.HexColor("#cfe2ff")))
+        elements.append(Paragraph(f"Total ingresos: {_fmt_crc(total_ingresos, 'CRC ')}", style_normal))
+        elements.extend(crear_tablas(df_ingresos, ["Fecha", "Concepto", "Monto"]))
+    else:
+        elements.append(color_box("Ingresos", colors.HexColor("#cfe2ff")))
+        elements.append(Paragraph("No se registraron ingresos en este período.\nTotal ingresos: CRC 0.00.", style_normal))
+
+    # Gastos
+    if not df_gastos.empty:
+        elements.append(color_box("Gastos", colors.HexColor("#f8d7da")))
+        elements.append(Paragraph(f"Total gastos: {_fmt_crc(total_gastos, 'CRC ')}", style_normal))
+        elements.extend(crear_tablas(df_gastos, ["Fecha", "Concepto", "Monto"]))
+    else:
+        elements.append(color_box("Gastos", colors.HexColor("#f8d7da")))
+        elements.append(Paragraph("No se registraron gastos en este período.\nTotal gastos: CRC 0.00.", style_normal))
+
+    # Balance final
+    balance_color = "#d1e7dd" if balance >= 0 else "#f8d7da"
+    balance_text_color = "#198754" if balance >= 0 else "#dc3545"
+    balance_text = f"<b>Balance final:</b> <font color='{balance_text_color}'>{_fmt_crc(balance, 'CRC ')}</font>"
+    elements.append(color_box("Balance final", colors.HexColor(balance_color)))
+    elements.append(Paragraph(balance_text, style_normal))
+
+    def _pie(canvas, doc):
+        canvas.saveState()
+        canvas.setFont("Helvetica", 8)
+        canvas.setFillColor(colors.grey)
+        canvas.drawRightString(A4[0] - 2*cm, 1.5*cm, f"Página {doc.page} - Barbería")
+        canvas.restoreState()
+
+    doc.build(elements, onLaterPages=_pie, onFirstPage=_pie)
+    return pdf_buffer.getvalue()
+
 # ============================================================
 # 🧭 UI – 5 pestañas
 # ============================================================
@@ -241,6 +1276,38 @@ menu = st.sidebar.radio(
     "Selecciona una sección",
     ["✂️ Registro de Cortes", "📦 Inventario", "📅 Citas", "💵 Finanzas", "📊 Reporte General"]
 )
+if _medicion is not None:
+    _medicion.etiqueta = menu
+
+# Los fragmentos de fila no pasan por aquí: esto corre solo en reruns completos
+_descartar_parches()
+
+# Estado de la sincronización cuando las escrituras son diferidas
+if _cola() is not None:
+    estado_cola = _cola().estado()
+    if estado_cola["errores"]:
+        st.sidebar.error(f"⚠️ {estado_cola['errores']} cambios no se pudieron sincronizar: {estado_cola['ultimo_error']}")
+        if st.sidebar.button("🔁 Reintentar sincronización"):
+            _cola().reintentar_errores()
+            st.rerun()
+    elif estado_cola["pendientes"]:
+        st.sidebar.info(f"🔄 {estado_cola['pendientes']} cambios pendientes de sincronizar con Google Sheets")
+    else:
+        st.sidebar.success("✅ Todo sincronizado con Google Sheets")
+
+# Recarga automática: la versión sube cuando la hoja cambia en Drive (la app de
+# clientes, otra réplica o alguien editando a mano) y con cada escritura de
+# este proceso (otra sesión), que el vigilante no cuenta (escritura_propia)
+if _storage() is None:
+    st.session_state["_version_vista"] = _version_hojas(*SCHEMAS)
+
+    @st.fragment(run_every=_vigilante().intervalo)
+    def _avisar_cambios():
+        if _version_hojas(*SCHEMAS) != st.session_state.get("_version_vista"):
+            st.rerun()
+
+    with st.sidebar:
+        _avisar_cambios()
 
 # ---------------------------------------------
 # ✂️ Registro de Cortes
@@ -255,7 +1322,7 @@ if menu == "✂️ Registro de Cortes":
         fecha = col1.date_input("Fecha", value=date.today())
         barbero = col2.text_input("Nombre del barbero")
         cliente = col3.text_input("Nombre del cliente")
-        tipo_corte = st.selectbox("Tipo de corte", ["Clásico", "Fade", "Diseño", "Barba", "Otro"])
+        tipo_corte = st.selectbox("Tipo de corte", TIPOS_CORTE)
         precio = st.number_input("Precio (₡)", min_value=0.0, step=500.0, format="%.2f")
         observacion = st.text_area("Observaciones (opcional)")
         submitted = st.form_submit_button("💾 Guardar")
@@ -267,74 +1334,119 @@ if menu == "✂️ Registro de Cortes":
                 st.success("✅ Corte registrado correctamente")
                 st.rerun()
 
+    with st.expander("📤 Carga masiva desde CSV / Excel"):
+        st.caption("Columnas: fecha, barbero, cliente, tipo_corte, precio y observacion (opcional).")
+        # La clave rota tras cada importación: así el archivo ya cargado no queda listo para repetirse
+        archivo = st.file_uploader("Archivo de cortes", type=["csv", "xlsx"],
+                                   key=f"carga_cortes_{st.session_state.get('cargas_cortes', 0)}")
+        if archivo is not None:
+            try:
+                if archivo.name.lower().endswith(".csv"):
+                    df_carga = pd.read_csv(archivo, dtype=str)
+                else:
+                    df_carga = pd.read_excel(archivo, dtype=str)
+            except Exception as e:
+                st.error(f"❌ No se pudo leer el archivo: {e}")
+                df_carga = None
+
+            if df_carga is not None:
+                df_carga.columns = [str(c).strip().lower() for c in df_carga.columns]
+                faltan = [c for c in ("fecha", "barbero", "cliente", "tipo_corte", "precio") if c not in df_carga.columns]
+                if faltan:
+                    st.warning(f"⚠️ Faltan columnas: {', '.join(faltan)}")
+                else:
+                    if "observacion" not in df_carga.columns:
+                        df_carga["observacion"] = ""
+                    df_carga = df_carga[["fecha", "barbero", "cliente", "tipo_corte", "precio", "observacion"]].fillna("")
+                    fechas = pd.to_datetime(df_carga["fecha"].str.strip(), errors="coerce", dayfirst=True)
+                    precios = pd.to_numeric(df_carga["precio"].str.strip().str.replace(",", ".", regex=False), errors="coerce")
+                    validas = fechas.notna() & precios.notna() & (df_carga["barbero"].str.strip() != "") & (df_carga["cliente"].str.strip() != "")
+                    df_carga["fecha"] = fechas.dt.strftime("%Y-%m-%d")
+                    df_carga["precio"] = precios
+                    for c in ("barbero", "cliente", "tipo_corte", "observacion"):
+                        df_carga[c] = df_carga[c].str.strip()
+
+                    st.dataframe(df_carga[validas], use_container_width=True)
+                    if (~validas).any():
+                        st.warning(f"⚠️ Se omitirán {int((~validas).sum())} filas sin fecha, precio, barbero o cliente válidos.")
+                    if validas.any() and st.button(f"📥 Importar {int(validas.sum())} cortes", key="importar_cortes"):
+                        insertar_cortes_lote(df_carga[validas].to_dict(orient="records"))
+                        st.session_state["cargas_cortes"] = st.session_state.get("cargas_cortes", 0) + 1
+                        st.success("✅ Cortes importados correctamente")
+                        st.rerun()
+
     st.divider()
     st.subheader("📋 Historial de cortes")
 
+    # La versión se toma antes de leer: una escritura en medio cambia la versión, no el respaldo ya memoizado
+    version_cortes = _version_hojas("Cortes")
     cortes = obtener_cortes()
     if cortes:
-        df = pd.DataFrame(cortes)
-        df["fecha"] = pd.to_datetime(df["fecha"]).dt.strftime("%d/%m/%Y")
-        try:
-            df["precio"] = pd.to_numeric(df["precio"], errors="coerce").round(2)
-        except Exception:
-            pass
-
-        # Excel respaldo
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name="Cortes")
-        st.download_button(
-            "⬇️ Descargar respaldo en Excel",
-            output.getvalue(),
-            "cortes_registrados.xlsx",
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-
-        for corte in cortes:
-            id_corte = int(corte["id"])
-            editando = st.session_state.get(f"edit_{id_corte}", False)
-
-            if editando:
-                st.markdown(f"### ✏️ Editando corte ID {id_corte}")
-                f = st.date_input("Fecha", value=pd.to_datetime(corte["fecha"]), key=f"fecha_{id_corte}")
-                b = st.text_input("Barbero", value=corte["barbero"], key=f"barbero_{id_corte}")
-                c = st.text_input("Cliente", value=corte["cliente"], key=f"cliente_{id_corte}")
-                tipos = ["Clásico", "Fade", "Diseño", "Barba", "Otro"]
-                try:
-                    idx = tipos.index(corte["tipo_corte"])
-                except:
-                    idx = 0
-                t = st.selectbox("Tipo de corte", tipos, index=idx, key=f"tipo_{id_corte}")
-                p = st.number_input("Precio (₡)", value=float(corte.get("precio") or 0), step=500.0, format="%.2f", key=f"precio_{id_corte}")
-                o = st.text_area("Observación", value=corte.get("observacion") or "", key=f"obs_{id_corte}")
-
-                col1, col2 = st.columns(2)
-                if col1.button("💾 Guardar", key=f"guardar_{id_corte}"):
-                    actualizar_corte(id_corte, {"fecha": str(f), "barbero": b, "cliente": c, "tipo_corte": t, "precio": p, "observacion": o})
-                    st.session_state[f"edit_{id_corte}"] = False
-                    st.success("✅ Corte actualizado")
-                    st.rerun()
-                if col2.button("❌ Cancelar", key=f"cancelar_{id_corte}"):
-                    st.session_state[f"edit_{id_corte}"] = False
-                    st.rerun()
-            else:
-                cols = st.columns([1.5, 2, 2, 2, 1.5, 3, 1, 1])
-                cols[0].markdown(f"🗓️ **{pd.to_datetime(corte['fecha']).strftime('%d/%m/%Y')}**")
-                cols[1].markdown(f"💈 **{corte['barbero']}**")
-                cols[2].markdown(f"👤 {corte['cliente']}")
-                cols[3].markdown(f"✂️ {corte['tipo_corte']}")
-                try:
-                    cols[4].markdown(f"💰 ₡{float(corte.get('precio') or 0):,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-                except:
-                    cols[4].markdown(f"💰 ₡{corte.get('precio')}")
-                cols[5].markdown(f"📝 {corte.get('observacion') or '—'}")
-                if cols[6].button("✏️", key=f"edit_{id_corte}"):
-                    st.session_state[f"edit_{id_corte}"] = True
-                    st.rerun()
-                if cols[7].button("🗑️", key=f"delete_{id_corte}"):
-                    eliminar_corte(id_corte)
-                    st.success("✅ Corte eliminado")
+        df_hist = _tabla(cortes)
+        df = df_hist[SCHEMAS["Cortes"]].assign(fecha=df_hist["fecha_txt"], precio=df_hist["precio"].round(2))
+
+        # Respaldo (Excel o CSV), generado solo a pedido
+        _boton_exportar(df, "Respaldo", "cortes_registrados", "Cortes", "cortes", version_cortes)
+
+        # 🔍 Filtros y paginación: solo se dibuja la página actual
+        fechas_hist = df_hist["fecha_dt"]
+        colf1, colf2, colf3, colf4 = st.columns(4)
+        f_desde = colf1.date_input("Desde", value=None, key="hist_desde")
+        f_hasta = colf2.date_input("Hasta", value=None, key="hist_hasta")
+        f_barbero = colf3.selectbox("Barbero", ["Todos"] + sorted(df_hist["barbero"].astype(str).unique()), key="hist_barbero")
+        f_tipo = colf4.selectbox("Tipo de corte", ["Todos"] + TIPOS_CORTE, key="hist_tipo")
+
+        mask = pd.Series(True, index=df_hist.index)
+        if f_desde:
+            mask &= fechas_hist.dt.date >= f_desde
+        if f_hasta:
+            mask &= fechas_hist.dt.date <= f_hasta
+        if f_barbero != "Todos":
+            mask &= df_hist["barbero"].astype(str) == f_barbero
+        if f_tipo != "Todos":
+            mask &= df_hist["tipo_corte"] == f_tipo
+        # Más recientes primero
+        df_hist = df_hist[mask].sort_values(["fecha_dt", "id"], ascending=False, na_position="last")
+
+        colp1, colp2, colp3, colp4 = st.columns([1, 1, 2, 2])
+        por_pagina = colp1.selectbox("Filas por página", [25, 50, 100], key="hist_por_pagina")
+        paginas = max(1, -(-len(df_hist) // por_pagina))
+        if st.session_state.get("hist_pagina", 1) > paginas:
+            st.session_state["hist_pagina"] = paginas
+        pagina = int(colp2.number_input("Página", min_value=1, max_value=paginas, value=1, step=1, key="hist_pagina"))
+        colp3.caption(f"{len(df_hist)} cortes · página {pagina} de {paginas}")
+        modo = colp4.radio("Vista", ["📋 Lista", "🧮 Tabla editable"], horizontal=True, key="hist_modo")
+        pagina_df = df_hist.iloc[(pagina - 1) * por_pagina: pagina * por_pagina]
+
+        if modo == "🧮 Tabla editable":
+            # Se editan varias filas y se guardan todas en una sola escritura
+            original = pagina_df[SCHEMAS["Cortes"]].reset_index(drop=True)
+            original["fecha"] = pagina_df["fecha_dt"].dt.date.values
+            for c in ("barbero", "cliente", "tipo_corte", "observacion"):
+                original[c] = original[c].astype(str)
+            editado = st.data_editor(
+                original,
+                key=f"editor_cortes_{pagina}",
+                hide_index=True,
+                disabled=["id"],
+                use_container_width=True,
+                column_config={
+                    "fecha": st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
+                    "tipo_corte": st.column_config.SelectboxColumn("Tipo de corte", options=TIPOS_CORTE),
+                    "precio": st.column_config.NumberColumn("Precio (₡)", min_value=0.0, step=500.0, format="%.2f"),
+                },
+            )
+            if st.button("💾 Guardar cambios de la tabla", key="guardar_tabla_cortes"):
+                cambios = _diferencias(original, editado)
+                if cambios:
+                    actualizar_cortes_lote(cambios)
+                    st.success(f"✅ {len(cambios)} cortes actualizados")
                     st.rerun()
+                else:
+                    st.info("No hay cambios que guardar.")
+        else:
+            for corte in pagina_df.to_dict(orient="records"):
+                _fila_corte(corte)
     else:
         st.info("Aún no se han registrado cortes.")
 
@@ -364,60 +1476,58 @@ elif menu == "📦 Inventario":
     st.divider()
     st.subheader("📋 Productos en inventario")
 
+    version_inventario = _version_hojas("Productos", "MovimientosStock")
     productos = obtener_productos()
     if productos:
-        df = pd.DataFrame(productos)
-        try:
-            df["precio_unitario"] = pd.to_numeric(df["precio_unitario"], errors="coerce")
-        except Exception:
-            pass
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="Productos")
-        st.download_button(
-            "⬇️ Descargar inventario en Excel",
-            output.getvalue(),
-            "inventario_productos.xlsx",
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-
-        for producto in productos:
-            idp = int(producto["id"])
-            editando = st.session_state.get(f"edit_prod_{idp}", False)
-
-            if editando:
-                st.markdown(f"### ✏️ Editando producto ID {idp}")
-                col1, col2 = st.columns(2)
-                nombre_edit = col1.text_input("Nombre", value=producto["nombre"], key=f"nombre_{idp}")
-                precio_edit = col2.number_input("Precio (₡)", value=float(producto.get("precio_unitario") or 0), step=100.0, format="%.2f", key=f"precio_{idp}")
-                descripcion_edit = st.text_input("Descripción", value=producto.get("descripcion") or "", key=f"desc_{idp}")
-                stock_edit = st.number_input("Stock", value=int(float(producto.get("stock") or 0)), step=1, key=f"stock_{idp}")
-                col1b, col2b = st.columns(2)
-                if col1b.button("💾 Guardar", key=f"guardar_{idp}"):
-                    actualizar_producto(idp, {"nombre": nombre_edit, "precio_unitario": precio_edit, "descripcion": descripcion_edit, "stock": stock_edit})
-                    st.session_state[f"edit_prod_{idp}"] = False
-                    st.success("✅ Producto actualizado")
-                    st.rerun()
-                if col2b.button("❌ Cancelar", key=f"cancelar_{idp}"):
-                    st.session_state[f"edit_prod_{idp}"] = False
+        df_prod = _tabla(productos)
+        # Stock vigente (base + movimientos) en lugar del valor guardado en la fila
+        df_prod["stock"] = df_prod["id"].map(stock_actual()).fillna(df_prod["stock"])
+        df = df_prod[SCHEMAS["Productos"]]
+
+        _boton_exportar(df, "Inventario", "inventario_productos", "Productos", "productos",
+                        version_inventario)
+
+        for producto in df_prod.to_dict(orient="records"):
+            _fila_producto(producto)
+
+        st.divider()
+        st.subheader("🔄 Registrar venta o entrada")
+        nombres = dict(zip(df_prod["id"].astype(int), df_prod["nombre"].astype(str)))
+        stock_por_id = dict(zip(df_prod["id"].astype(int), df_prod["stock"]))
+        tipo_mov = st.radio("Tipo", ["🛒 Venta", "📥 Entrada"], horizontal=True, key="mov_tipo")
+        elegidos = st.multiselect("Productos", list(nombres), format_func=lambda pid: nombres[pid], key="mov_productos")
+        cantidades = {}
+        for pid in elegidos:
+            cantidades[pid] = st.number_input(f"{nombres[pid]} (stock {int(stock_por_id[pid])})",
+                                              min_value=1, step=1, key=f"mov_cant_{pid}")
+        if elegidos and st.button("💾 Registrar", key="mov_registrar"):
+            if tipo_mov == "🛒 Venta":
+                faltan = [nombres[pid] for pid, c in cantidades.items() if c > stock_por_id[pid]]
+                if faltan:
+                    st.warning(f"⚠️ Stock insuficiente: {', '.join(faltan)}")
+                else:
+                    registrar_venta(cantidades)
+                    st.session_state.pop("mov_productos", None)
+                    st.success(f"✅ Venta registrada ({len(cantidades)} productos)")
                     st.rerun()
             else:
-                cols = st.columns([2, 2, 2, 2, 1, 1])
-                cols[0].markdown(f"📦 **{producto['nombre']}**")
-                cols[1].markdown(f"🧾 {producto.get('descripcion') or '—'}")
-                try:
-                    cols[2].markdown(f"💰 ₡{float(producto.get('precio_unitario') or 0):,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-                except:
-                    cols[2].markdown(f"💰 ₡{producto.get('precio_unitario')}")
-                cols[3].markdown(f"📦 Stock: {int(float(producto.get('stock') or 0))}")
-                if cols[4].button("✏️", key=f"edit_{idp}"):
-                    st.session_state[f"edit_prod_{idp}"] = True
-                    st.rerun()
-                if cols[5].button("🗑️", key=f"del_{idp}"):
-                    eliminar_producto(idp)
-                    st.success("✅ Producto eliminado")
-                    st.rerun()
+                registrar_entrada(cantidades)
+                st.session_state.pop("mov_productos", None)
+                st.success(f"✅ Entrada registrada ({len(cantidades)} productos)")
+                st.rerun()
+
+        with st.expander("📜 Últimos movimientos de stock"):
+            df_mov = _tabla(obtener_movimientos_stock())
+            if df_mov.empty:
+                st.info("Todavía no hay movimientos.")
+            else:
+                df_mov = df_mov.sort_values(["fecha_dt", "id"], ascending=False).head(50)
+                st.dataframe(pd.DataFrame({
+                    "Fecha": df_mov["fecha_txt"],
+                    "Producto": df_mov["producto_id"].map(nombres).fillna("(eliminado)"),
+                    "Cantidad": df_mov["cantidad"],
+                    "Motivo": df_mov["motivo"],
+                }), use_container_width=True, hide_index=True)
     else:
         st.info("No hay productos registrados todavía.")
 
@@ -428,80 +1538,45 @@ elif menu == "📅 Citas":
     st.title("📅 Gestión de Citas")
     st.markdown("Revisa y administra las citas solicitadas por los clientes.")
 
-    citas = obtener_citas()
-    df = pd.DataFrame(citas)
+    # 🔍 Filtros antes de leer: por defecto solo de hoy en adelante
+    estados = ["todas", "pendiente", "aceptada", "rechazada"]
+    colf1, colf2, colf3 = st.columns(3)
+    estado_filtro = colf1.selectbox("🔍 Filtrar por estado", estados, key="citas_estado")
+    c_desde = colf2.date_input("Desde", value=date.today(), key="citas_desde")
+    c_hasta = colf3.date_input("Hasta", value=None, key="citas_hasta")
 
-    # 🔧 Normaliza hora a HH:MM para evitar '8:30' vs '08:30'
-    if not df.empty and "hora" in df.columns:
-        def _norm_hhmm(x):
-            x = str(x).strip()
-            if ":" not in x: return x
-            h, m = x.split(":", 1)
-            try: return f"{int(h):02d}:{int(m):02d}"
-            except: return x
-        df["hora"] = df["hora"].astype(str).map(_norm_hhmm)
+    df = _tabla(obtener_citas_filtradas(None if estado_filtro == "todas" else estado_filtro, c_desde, c_hasta))
 
     if df.empty:
-        st.info("No hay citas registradas.")
+        st.info("No hay citas para esos filtros.")
     else:
-        estados = ["todas", "pendiente", "aceptada", "rechazada"]
-        estado_filtro = st.selectbox("🔍 Filtrar por estado", estados)
-        if estado_filtro != "todas":
-            df = df[df["estado"] == estado_filtro]
-
-        for cita in df.to_dict(orient="records"):
-            cid = int(cita["id"])
-            st.markdown(f"### 🧾 Cita ID {cid}")
-            col1, col2, col3 = st.columns(3)
-            try:
-                fecha_show = pd.to_datetime(cita["fecha"]).strftime("%d/%m/%Y")
-            except:
-                fecha_show = str(cita["fecha"])
-            col1.markdown(f"**📅 Fecha:** {fecha_show}")
-            col2.markdown(f"**🕒 Hora:** {cita['hora']}")
-            col3.markdown(f"**🧴 Servicio:** {cita['servicio']}")
-            st.markdown(f"**👤 Cliente:** {cita['cliente_nombre']}")
-            st.markdown(f"**✂️ Barbero asignado:** {cita.get('barbero') or 'Sin asignar'}")
-            st.markdown(f"**📌 Estado actual:** `{cita['estado']}`")
-
-            with st.expander("✏️ Editar cita"):
-                # Fecha
-                try:
-                    valor_fecha = pd.to_datetime(cita["fecha"]).date()
-                except:
-                    valor_fecha = date.today()
-                nueva_fecha = st.date_input("📅 Nueva fecha", value=valor_fecha, key=f"fecha_{cid}")
-                # Hora
-                try:
-                    hora_original = datetime.strptime(cita["hora"], "%H:%M").time()
-                except:
-                    try:
-                        hora_original = datetime.strptime(cita["hora"], "%H:%M:%S").time()
-                    except:
-                        hora_original = datetime.strptime("08:00", "%H:%M").time()
-                nueva_hora = st.time_input("🕒 Nueva hora", value=hora_original, key=f"hora_{cid}")
-                nuevo_barbero = st.text_input("✂️ Asignar barbero", value=cita.get("barbero") or "", key=f"barbero_{cid}")
-
-                col_e1, col_e2 = st.columns(2)
-                if col_e1.button("💾 Guardar cambios", key=f"guardar_cita_{cid}"):
-                    actualizar_cita(cid, {"fecha": nueva_fecha.strftime("%Y-%m-%d"), "hora": nueva_hora.strftime("%H:%M"), "barbero": nuevo_barbero})
-                    st.success("✅ Cita actualizado")
-                    st.rerun()
-                if col_e2.button("🗑️ Eliminar cita", key=f"eliminar_cita_{cid}"):
-                    eliminar_cita(cid)
-                    st.success("✅ Cita eliminada")
-                    st.rerun()
-
-            col_a1, col_a2 = st.columns(2)
-            if cita["estado"] == "pendiente":
-                if col_a1.button("✅ Aceptar", key=f"aceptar_{cid}"):
-                    actualizar_estado_cita(cid, "aceptada")
-                    st.success("📬 Cita aceptada")
-                    st.rerun()
-                if col_a2.button("❌ Rechazar", key=f"rechazar_{cid}"):
-                    actualizar_estado_cita(cid, "rechazada")
-                    st.warning("📭 Cita rechazada")
-                    st.rerun()
+        df = df.sort_values(["fecha_dt", "hora", "id"], na_position="last").reset_index(drop=True)
+        st.caption(f"{len(df)} citas · selecciona filas para aceptarlas, rechazarlas o editarlas")
+        vista = df[["id", "fecha_txt", "hora", "cliente_nombre", "servicio", "barbero", "estado"]].rename(columns={
+            "fecha_txt": "Fecha", "hora": "Hora", "cliente_nombre": "Cliente", "servicio": "Servicio",
+            "barbero": "Barbero", "estado": "Estado"})
+        evento = st.dataframe(vista, use_container_width=True, hide_index=True, key="citas_tabla",
+                              on_select="rerun", selection_mode="multi-row")
+        # La selección guarda posiciones; tras un cambio de filtros puede quedar fuera de rango
+        seleccion = df.iloc[[i for i in evento.selection.rows if i < len(df)]]
+        pendientes = seleccion.loc[seleccion["estado"] == "pendiente", "id"].astype(int).tolist()
+
+        # Acciones en lote: una sola escritura para todas las seleccionadas
+        colb1, colb2 = st.columns(2)
+        if colb1.button(f"✅ Aceptar seleccionadas ({len(pendientes)})", key="aceptar_sel", disabled=not pendientes):
+            actualizar_estado_citas(pendientes, "aceptada")
+            st.session_state.pop("citas_tabla", None)
+            st.success(f"📬 {len(pendientes)} citas aceptadas")
+            st.rerun()
+        if colb2.button(f"❌ Rechazar seleccionadas ({len(pendientes)})", key="rechazar_sel", disabled=not pendientes):
+            actualizar_estado_citas(pendientes, "rechazada")
+            st.session_state.pop("citas_tabla", None)
+            st.warning(f"📭 {len(pendientes)} citas rechazadas")
+            st.rerun()
+
+        # Detalle y edición solo de las citas seleccionadas
+        for cita in seleccion.to_dict(orient="records"):
+            _tarjeta_cita(cita, estado_filtro)
 
 # ---------------------------------------------
 # 💵 Finanzas
@@ -545,83 +1620,56 @@ elif menu == "💵 Finanzas":
     st.divider()
     st.subheader("📊 Resumen de movimientos")
 
-    ingresos = obtener_ingresos()
-    gastos = obtener_gastos()
-
-    total_i = sum(float(i.get("monto") or 0) for i in ingresos)
-    total_g = sum(float(g.get("monto") or 0) for g in gastos)
+    total_i = float(resumen_ingresos()["total"].sum())
+    total_g = float(resumen_gastos()["total"].sum())
     balance = total_i - total_g
     color = "green" if balance >= 0 else "red"
 
-    st.markdown(f"**💰 Total Ingresos:** ₡{total_i:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-    st.markdown(f"**💸 Total Gastos:** ₡{total_g:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+    st.markdown(f"**💰 Total Ingresos:** {_fmt_crc(total_i)}")
+    st.markdown(f"**💸 Total Gastos:** {_fmt_crc(total_g)}")
     st.markdown(
-        f"<strong>🧾 Balance general:</strong> <span style='color:{color}; font-weight:bold;'>₡{balance:,.2f}</span>"
-        .replace(",", "X").replace(".", ",").replace("X", "."),
+        f"<strong>🧾 Balance general:</strong> <span style='color:{color}; font-weight:bold;'>{_fmt_crc(balance)}</span>",
         unsafe_allow_html=True
     )
 
     st.divider()
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown("### 📋 Ingresos")
-        if ingresos:
-            for ingreso in ingresos:
-                _id = int(ingreso["id"])
-                st.markdown(f"📅 {pd.to_datetime(ingreso['fecha']).strftime('%d/%m/%Y')} | 💰 ₡{float(ingreso.get('monto') or 0):,.2f} | 📄 {ingreso['concepto']}".replace(",", "X").replace(".", ",").replace("X", "."))
-                st.markdown(f"📝 {ingreso.get('observacion') or '—'}")
-                c1, c2 = st.columns(2)
-                if c1.button("✏️ Editar", key=f"editar_i_{_id}"):
-                    st.session_state[f"edit_ingreso_{_id}"] = True
-                if c2.button("🗑️ Eliminar", key=f"eliminar_i_{_id}"):
-                    eliminar_ingreso(_id); st.rerun()
-
-            for ingreso in ingresos:
-                _id = int(ingreso["id"])
-                if st.session_state.get(f"edit_ingreso_{_id}"):
-                    st.markdown(f"#### ✏️ Editando ingreso ID {_id}")
-                    f = st.date_input("Fecha", value=pd.to_datetime(ingreso["fecha"]), key=f"fecha_i_{_id}")
-                    c = st.text_input("Concepto", value=ingreso["concepto"], key=f"concepto_i_{_id}")
-                    m = st.number_input("Monto (₡)", value=float(ingreso.get("monto") or 0), key=f"monto_i_{_id}", step=500.0)
-                    o = st.text_input("Observación", value=ingreso.get("observacion") or "", key=f"obs_i_{_id}")
-                    cc1, cc2 = st.columns(2)
-                    if cc1.button("💾 Guardar", key=f"guardar_i_{_id}"):
-                        actualizar_ingreso(_id, {"fecha": str(f), "concepto": c, "monto": m, "observacion": o})
-                        st.session_state[f"edit_ingreso_{_id}"] = False; st.rerun()
-                    if cc2.button("❌ Cancelar", key=f"cancelar_i_{_id}"):
-                        st.session_state[f"edit_ingreso_{_id}"] = False; st.rerun()
-        else:
-            st.info("No hay ingresos registrados.")
-
-    with col2:
-        st.markdown("### 📋 Gastos")
-        if gastos:
-            for gasto in gastos:
-                _id = int(gasto["id"])
-                st.markdown(f"📅 {pd.to_datetime(gasto['fecha']).strftime('%d/%m/%Y')} | 💸 ₡{float(gasto.get('monto') or 0):,.2f} | 📄 {gasto['concepto']}".replace(",", "X").replace(".", ",").replace("X", "."))
-                st.markdown(f"📝 {gasto.get('observacion') or '—'}")
-                c1, c2 = st.columns(2)
-                if c1.button("✏️ Editar", key=f"editar_g_{_id}"):
-                    st.session_state[f"edit_gasto_{_id}"] = True
-                if c2.button("🗑️ Eliminar", key=f"eliminar_g_{_id}"):
-                    eliminar_gasto(_id); st.rerun()
-
-            for gasto in gastos:
-                _id = int(gasto["id"])
-                if st.session_state.get(f"edit_gasto_{_id}"):
-                    st.markdown(f"#### ✏️ Editando gasto ID {_id}")
-                    f = st.date_input("Fecha", value=pd.to_datetime(gasto["fecha"]), key=f"fecha_g_{_id}")
-                    c = st.text_input("Concepto", value=gasto["concepto"], key=f"concepto_g_{_id}")
-                    m = st.number_input("Monto (₡)", value=float(gasto.get("monto") or 0), key=f"monto_g_{_id}", step=500.0)
-                    o = st.text_input("Observación", value=gasto.get("observacion") or "", key=f"obs_g_{_id}")
-                    cc1, cc2 = st.columns(2)
-                    if cc1.button("💾 Guardar", key=f"guardar_g_{_id}"):
-                        actualizar_gasto(_id, {"fecha": str(f), "concepto": c, "monto": m, "observacion": o})
-                        st.session_state[f"edit_gasto_{_id}"] = False; st.rerun()
-                    if cc2.button("❌ Cancelar", key=f"cancelar_g_{_id}"):
-                        st.session_state[f"edit_gasto_{_id}"] = False; st.rerun()
-        else:
-            st.info("No hay gastos registrados.")
+    st.subheader("📒 Libro de movimientos")
+
+    libro = _libro_movimientos(_tabla(obtener_ingresos()), _tabla(obtener_gastos()))
+    if libro.empty:
+        st.info("No hay movimientos registrados.")
+    else:
+        # 🔍 Filtros y paginación: el saldo se calcula sobre todo el libro y
+        # solo se dibujan las filas de la página actual
+        colf1, colf2, colf3, colf4 = st.columns(4)
+        f_desde = colf1.date_input("Desde", value=None, key="libro_desde")
+        f_hasta = colf2.date_input("Hasta", value=None, key="libro_hasta")
+        f_tipo = colf3.selectbox("Tipo", ["Todos", "Ingresos", "Gastos"], key="libro_tipo")
+        f_concepto = colf4.text_input("Concepto contiene", key="libro_concepto")
+
+        mask = pd.Series(True, index=libro.index)
+        if f_desde:
+            mask &= libro["fecha_dt"].dt.date >= f_desde
+        if f_hasta:
+            mask &= libro["fecha_dt"].dt.date <= f_hasta
+        if f_tipo != "Todos":
+            mask &= libro["hoja"] == f_tipo
+        if f_concepto.strip():
+            mask &= libro["concepto"].astype(str).str.contains(f_concepto.strip(), case=False, regex=False)
+        # Más recientes primero
+        libro = libro[mask].iloc[::-1]
+
+        colp1, colp2, colp3 = st.columns([1, 1, 4])
+        por_pagina = colp1.selectbox("Filas por página", [25, 50, 100], key="libro_por_pagina")
+        paginas = max(1, -(-len(libro) // por_pagina))
+        if st.session_state.get("libro_pagina", 1) > paginas:
+            st.session_state["libro_pagina"] = paginas
+        pagina = int(colp2.number_input("Página", min_value=1, max_value=paginas, value=1, step=1, key="libro_pagina"))
+        colp3.caption(f"{len(libro)} movimientos · página {pagina} de {paginas} · "
+                      f"neto del filtro {_fmt_crc(float(libro['signo'].sum()))}")
+
+        for mov in libro.iloc[(pagina - 1) * por_pagina: pagina * por_pagina].to_dict(orient="records"):
+            _fila_movimiento(mov["hoja"], mov)
 
 # ---------------------------------------------
 # 📊 Reporte General
@@ -634,24 +1682,29 @@ elif menu == "📊 Reporte General":
     fecha_inicio = col1.date_input("📅 Desde", value=date(2025, 1, 1))
     fecha_fin = col2.date_input("📅 Hasta", value=date.today())
 
-    df_cortes = pd.DataFrame(obtener_cortes())
-    df_ingresos = pd.DataFrame(obtener_ingresos())
-    df_gastos = pd.DataFrame(obtener_gastos())
+    version = _version_hojas("Ingresos", "Gastos")  # antes de leer, igual que los respaldos
+    res_cortes = resumen_cortes(fecha_inicio, fecha_fin)
+    df_ingresos = _tabla(obtener_ingresos_rango(fecha_inicio, fecha_fin))
+    df_gastos = _tabla(obtener_gastos_rango(fecha_inicio, fecha_fin))
 
-    def filtrar(df, col="fecha"):
+    def filtrar(df):
         if df.empty: return df
-        df[col] = pd.to_datetime(df[col]).dt.date
-        return df[(df[col] >= fecha_inicio) & (df[col] <= fecha_fin)]
+        en_rango = (df["fecha_dt"] >= pd.Timestamp(fecha_inicio)) & (df["fecha_dt"] < pd.Timestamp(fecha_fin) + pd.Timedelta(days=1))
+        df = df[en_rango]
+        return df.assign(fecha=df["fecha_dt"].dt.date)
 
-    df_cortes = filtrar(df_cortes)
     df_ingresos = filtrar(df_ingresos)
     df_gastos = filtrar(df_gastos)
 
     st.subheader("💈 Cortes realizados")
-    if not df_cortes.empty:
-        tot = len(df_cortes)
-        por_barbero = df_cortes["barbero"].value_counts().reset_index()
-        por_barbero.columns = ["Barbero", "Cantidad de cortes"]
+    if not res_cortes.empty:
+        tot = int(res_cortes["cantidad"].sum())
+        por_barbero = (
+            res_cortes.groupby("clave")[["cantidad", "total"]].sum()
+            .sort_values("cantidad", ascending=False).reset_index()
+        )
+        por_barbero["total"] = _fmt_crc_serie(por_barbero["total"])
+        por_barbero.columns = ["Barbero", "Cantidad de cortes", "Total cobrado"]
         st.markdown(f"**Total de cortes:** {tot}")
         st.dataframe(por_barbero, use_container_width=True)
     else:
@@ -659,9 +1712,8 @@ elif menu == "📊 Reporte General":
 
     st.subheader("💰 Ingresos")
     if not df_ingresos.empty:
-        df_ingresos["monto"] = pd.to_numeric(df_ingresos["monto"], errors="coerce")
-        total_ingresos = df_ingresos["monto"].sum()
-        st.markdown(f"**Total de ingresos:** ₡{total_ingresos:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+        total_ingresos = float(df_ingresos["monto"].sum())
+        st.markdown(f"**Total de ingresos:** {_fmt_crc(total_ingresos)}")
         st.dataframe(df_ingresos[["fecha", "concepto", "monto", "observacion"]], use_container_width=True)
     else:
         total_ingresos = 0
@@ -669,9 +1721,8 @@ elif menu == "📊 Reporte General":
 
     st.subheader("💸 Gastos")
     if not df_gastos.empty:
-        df_gastos["monto"] = pd.to_numeric(df_gastos["monto"], errors="coerce")
-        total_gastos = df_gastos["monto"].sum()
-        st.markdown(f"**Total de gastos:** ₡{total_gastos:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+        total_gastos = float(df_gastos["monto"].sum())
+        st.markdown(f"**Total de gastos:** {_fmt_crc(total_gastos)}")
         st.dataframe(df_gastos[["fecha", "concepto", "monto", "observacion"]], use_container_width=True)
     else:
         total_gastos = 0
@@ -682,93 +1733,51 @@ elif menu == "📊 Reporte General":
     balance = (total_ingresos or 0) - (total_gastos or 0)
     color = "green" if balance >= 0 else "red"
     st.markdown(
-        f"<strong>Balance final:</strong> <span style='color:{color}; font-weight:bold;'>₡{balance:,.2f}</span>"
-        .replace(",", "X").replace(".", ",").replace("X", "."),
+        f"<strong>Balance final:</strong> <span style='color:{color}; font-weight:bold;'>{_fmt_crc(balance)}</span>",
         unsafe_allow_html=True
     )
 
-    # PDF
+    # PDF (se arma solo cuando se pide y se reutiliza mientras no cambien período ni datos)
     st.divider()
     st.subheader("⬇️ Descargar informe financiero (PDF)")
-    pdf_buffer = io.BytesIO()
-    doc = SimpleDocTemplate(pdf_buffer, pagesize=A4, leftMargin=2*cm, rightMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
-    styles = getSampleStyleSheet()
-    elements = []
-
-    style_title = ParagraphStyle("title", fontSize=16, alignment=1, textColor=colors.white, backColor=colors.HexColor("#007bff"), spaceAfter=12, spaceBefore=6, leading=20)
-    style_section_title = ParagraphStyle("section", fontSize=12, textColor=colors.white, leftIndent=0, spaceBefore=12, spaceAfter=6, leading=14)
-    style_normal = styles["Normal"]; style_normal.spaceAfter = 6
-
-    def color_box(text, bgcolor):
-        return Table([[Paragraph(text, style_section_title)]], colWidths=[doc.width], style=[
-            ("BACKGROUND", (0, 0), (-1, -1), bgcolor),
-            ("LEFTPADDING", (0, 0), (-1, -1), 6),
-            ("TOPPADDING", (0, 0), (-1, -1), 4),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 4)
-        ])
-
-    def crear_tabla(data, headers):
-        table_data = [headers] + data
-        return Table(table_data, style=[
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#e8e8e8")),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ], hAlign='LEFT')
-
-    elements.append(Paragraph("Informe Financiero", style_title))
-    elements.append(Paragraph("Este informe fue generado automáticamente por la Barbería [Nombre de la Barbería].", style_normal))
-    elements.append(Paragraph(f"<i>Período: {fecha_inicio.strftime('%d-%m-%Y')} al {fecha_fin.strftime('%d-%m-%Y')}</i>", style_normal))
-
-    # Ingresos
-    if not df_ingresos.empty:
-        elements.append(color_box("Ingresos", colors.HexColor("#cfe2ff")))
-        elements.append(Paragraph(f"Total ingresos: CRC {total_ingresos:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), style_normal))
-        ingresos_data = df_ingresos[["fecha", "concepto", "monto"]].astype(str).values.tolist()
-        elements.append(crear_tabla(ingresos_data, ["Fecha", "Concepto", "Monto"]))
-    else:
-        elements.append(color_box("Ingresos", colors.HexColor("#cfe2ff")))
-        elements.append(Paragraph("No se registraron ingresos en este período.\nTotal ingresos: CRC 0.00.", style_normal))
-
-    # Gastos
-    if not df_gastos.empty:
-        elements.append(color_box("Gastos", colors.HexColor("#f8d7da")))
-        elements.append(Paragraph(f"Total gastos: CRC {total_gastos:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), style_normal))
-        gastos_data = df_gastos[["fecha", "concepto", "monto"]].astype(str).values.tolist()
-        elements.append(crear_tabla(gastos_data, ["Fecha", "Concepto", "Monto"]))
-    else:
-        elements.append(color_box("Gastos", colors.HexColor("#f8d7da")))
-        elements.append(Paragraph("No se registraron gastos en este período.\nTotal gastos: CRC 0.00.", style_normal))
-
-    # Balance final
-    balance_color = "#d1e7dd" if balance >= 0 else "#f8d7da"
-    balance_text_color = "#198754" if balance >= 0 else "#dc3545"
-    balance_text = f"<b>Balance final:</b> <font color='{balance_text_color}'>CRC {balance:,.2f}</font>".replace(",", "X").replace(".", ",").replace("X", ".")
-    elements.append(color_box("Balance final", colors.HexColor(balance_color)))
-    elements.append(Paragraph(balance_text, style_normal))
-
-    def _pie(canvas, doc):
-        canvas.saveState()
-        canvas.setFont("Helvetica", 8)
-        canvas.setFillColor(colors.grey)
-        canvas.drawRightString(A4[0] - 2*cm, 1.5*cm, f"Página {doc.page} - Barbería")
-        canvas.restoreState()
-
-    doc.build(elements, onLaterPages=_pie, onFirstPage=_pie)
-
-    st.download_button(
-        "📄 Descargar informe financiero (PDF)",
-        pdf_buffer.getvalue(),
-        "informe_financiero.pdf",
-        "application/pdf"
-    )
-
-
-
-
-
-
-
+    clave_pdf = (str(fecha_inicio), str(fecha_fin), version)
+    if st.button("🧾 Generar informe PDF", key="generar_pdf"):
+        st.session_state["pdf_pedido"] = clave_pdf
+    if st.session_state.get("pdf_pedido") == clave_pdf:
+        with st.spinner("Generando PDF..."):
+            pdf = _informe_pdf(fecha_inicio, fecha_fin, version, df_ingresos, df_gastos, total_ingresos, total_gastos)
+        st.download_button(
+            "📄 Descargar informe financiero (PDF)",
+            pdf,
+            "informe_financiero.pdf",
+            "application/pdf"
+        )
 
+# ---------------------------------------------
+# ⚙️ Diagnóstico (oculto: ?diag=1 en la URL o diagnostico = true en secrets)
+# ---------------------------------------------
+if _diag_panel:
+    with st.sidebar.expander("⚙️ Diagnóstico"):
+        df_diag = pd.DataFrame(_medicion.resumen(), columns=["tipo", "nombre", "llamadas", "segundos", "bytes"])
+        api = df_diag[df_diag["tipo"] == "api"]
+        st.markdown(
+            f"**Rerun:** {_medicion.transcurrido():.2f} s · **API:** {int(api['llamadas'].sum())} llamadas, "
+            f"{api['segundos'].sum():.2f} s, {api['bytes'].sum() / 1024:.1f} KB"
+        )
+        st.dataframe(df_diag.round({"segundos": 3}), use_container_width=True, hide_index=True)
+        # Fragmentos redibujados solos y reruns cortados por st.rerun() desde el anterior
+        for previa in st.session_state.pop("_diag_anteriores", []):
+            api_previa = [e for e in previa.eventos if e["tipo"] == "api"]
+            st.caption(
+                f"Antes · {previa.etiqueta}: {previa.transcurrido():.2f} s · {len(api_previa)} llamadas API, "
+                f"{sum(e['segundos'] for e in api_previa):.2f} s"
+            )
+        gob = _gobernador()
+        st.caption(
+            f"Proceso: {gob.llamadas} llamadas · {gob.reintentos} reintentos · "
+            f"{gob.coalescidas} lecturas compartidas · {gob.segundos_en_cola:.1f} s esperando cuota"
+        )
+if _traza:
+    _medicion.volcar(_traza)
+if _medicion is not None:
+    _medicion.cerrar()
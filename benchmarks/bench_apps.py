@@ -0,0 +1,225 @@
+# ---------------------------------------------
+# 🧪 Benchmarks sin conexión
+# benchmarks/bench_apps.py – app.py y clientes_app.py contra una hoja falsa
+# ---------------------------------------------
+# Recorre cada pestaña y las operaciones CRUD de ambas apps con el AppTest de
+# Streamlit, sobre hojas de 100, 10.000 y 100.000 filas (o las que se pidan).
+# Por cada render u operación informa llamadas a la API, tiempo y pico de
+# memoria (tracemalloc).
+#
+#   python benchmarks/bench_apps.py
+#   python benchmarks/bench_apps.py --filas 100 10000 --latencia 0.05 --salida bench.csv
+#
+# La cuota del gobernador se levanta para medir la app y no la espera de cuota.
+# tracemalloc agrega su propio costo al tiempo: con --sin-memoria los tiempos
+# salen limpios.
+import argparse
+import gc
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import pandas as pd
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from hoja_falsa import ClienteFalso, instalar
+
+# Sin avisos de Streamlit (deprecaciones, limpiar cachés fuera de un servidor)
+# entre medio de los resultados
+for nombre in ("streamlit.deprecation_util", "streamlit.runtime.caching.cache_data_api",
+               "streamlit.runtime.scriptrunner_utils.script_run_context"):
+    logging.getLogger(nombre).addFilter(lambda registro: False)
+
+TAMANOS = [100, 10_000, 100_000]
+MAX_PRODUCTOS = 200  # Inventario dibuja todos los productos: un catálogo real es chico
+
+CABECERAS = {
+    "Cortes": ["id", "fecha", "barbero", "cliente", "tipo_corte", "precio", "observacion"],
+    "Productos": ["id", "nombre", "descripcion", "stock", "precio_unitario"],
+    "Citas": ["id", "fecha", "hora", "cliente_nombre", "barbero", "servicio", "estado"],
+    "Ingresos": ["id", "fecha", "concepto", "monto", "observacion"],
+    "Gastos": ["id", "fecha", "concepto", "monto", "observacion"],
+    "MovimientosStock": ["id", "fecha", "producto_id", "cantidad", "motivo"],
+}
+BARBEROS = ["Juan", "Pedro", "Luis", "Carlos"]
+ESTADOS = ["pendiente", "aceptada", "rechazada"]
+
+
+def sembrar(cliente: ClienteFalso, filas: int):
+    """Historial de `filas` registros por hoja, 20 por día, terminando hoy (citas: un 5% a futuro)."""
+    hoy = date.today()
+    dias = max(1, filas // 20)
+    fecha = lambda i, corrimiento=0: str(hoy - timedelta(days=dias - i * dias // filas - corrimiento))
+    productos = min(filas, MAX_PRODUCTOS)
+    libro = cliente.libro
+    libro.cargar("Cortes", [CABECERAS["Cortes"]] + [
+        [i, fecha(i), BARBEROS[i % 4], f"Cliente {i}", "Clásico", 5000 + 500 * (i % 6), ""] for i in range(1, filas + 1)])
+    libro.cargar("Productos", [CABECERAS["Productos"]] + [
+        [i, f"Producto {i}", "", 50, 1500 + 100 * (i % 10)] for i in range(1, productos + 1)])
+    libro.cargar("Citas", [CABECERAS["Citas"]] + [
+        [i, fecha(i, max(1, dias // 20)), f"{8 + i % 11:02d}:{30 * (i % 2):02d}", f"Cliente {i}", "", "Barba", ESTADOS[i % 3]]
+        for i in range(1, filas + 1)])
+    libro.cargar("Ingresos", [CABECERAS["Ingresos"]] + [
+        [i, fecha(i), f"Ingreso {i % 50}", 1000 * (1 + i % 9), ""] for i in range(1, filas + 1)])
+    libro.cargar("Gastos", [CABECERAS["Gastos"]] + [
+        [i, fecha(i), f"Gasto {i % 50}", 700 * (1 + i % 9), ""] for i in range(1, filas + 1)])
+    libro.cargar("MovimientosStock", [CABECERAS["MovimientosStock"]] + [
+        [i, fecha(i), 1 + i % productos, -1 if i % 3 else 5, "venta" if i % 3 else "entrada"] for i in range(1, filas + 1)])
+
+
+def _nueva_app(ruta: str) -> AppTest:
+    at = AppTest.from_file(os.path.join(RAIZ, ruta), default_timeout=900)
+    at.secrets["gcp_service_account"] = {"benchmark": True}
+    return at
+
+
+def _por_etiqueta(widgets, etiqueta: str):
+    return next(w for w in widgets if w.label == etiqueta)
+
+
+def _por_prefijo(widgets, prefijo: str):
+    return next(w for w in widgets if str(w.key or "").startswith(prefijo))
+
+
+def _medir(cliente: ClienteFalso, memoria: bool, fn: Callable[[], AppTest]) -> Dict[str, Any]:
+    gc.collect()
+    cliente.reiniciar()
+    if memoria:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    error = ""
+    try:
+        at = fn()
+        if at.exception:
+            error = at.exception[0].value.splitlines()[0]
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    segundos = time.perf_counter() - t0
+    pico = 0.0
+    if memoria:
+        pico = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return {"llamadas": cliente.total(), "segundos": round(segundos, 3), "pico_mb": round(pico, 1),
+            "detalle": dict(cliente.llamadas), "error": error}
+
+
+def escenarios_admin(at: AppTest) -> List[tuple]:
+    """(operación, función) en orden; cada una deja la app lista para la siguiente."""
+    def pestana(nombre):
+        return lambda: at.sidebar.radio[0].set_value(nombre).run()
+
+    def insertar_corte():
+        _por_etiqueta(at.text_input, "Nombre del barbero").set_value("Bench")
+        _por_etiqueta(at.text_input, "Nombre del cliente").set_value("Bench")
+        return _por_etiqueta(at.button, "💾 Guardar").click().run()
+
+    def editar_corte():
+        boton = _por_prefijo(at.button, "edit_")
+        id_corte = boton.key.split("_", 1)[1]
+        boton.click().run()
+        at.text_input(key=f"cliente_{id_corte}").set_value("Editado")
+        return at.button(key=f"guardar_{id_corte}").click().run()
+
+    def eliminar_corte():
+        return _por_prefijo(at.button, "delete_").click().run()
+
+    def insertar_ingreso():
+        _por_etiqueta(at.text_input, "Concepto del ingreso").set_value("Bench")
+        return _por_etiqueta(at.button, "💾 Guardar ingreso").click().run()
+
+    def aceptar_citas():
+        # AppTest no simula clics en la tabla: la selección se carga en el estado
+        # (y se repite antes del clic porque cada run la reinicia)
+        seleccion = {"selection": {"rows": list(range(10)), "columns": [], "cells": []}}
+        at.selectbox(key="citas_estado").set_value("pendiente")
+        at.session_state["citas_tabla"] = seleccion
+        at.run()
+        at.session_state["citas_tabla"] = seleccion
+        return at.button(key="aceptar_sel").click().run()
+
+    def registrar_venta():
+        at.multiselect(key="mov_productos").set_value([1, 2, 3]).run()
+        return at.button(key="mov_registrar").click().run()
+
+    return [
+        ("render Cortes (arranque)", at.run),
+        ("render Cortes (rerun)", at.run),
+        ("insertar corte", insertar_corte),
+        ("editar corte", editar_corte),
+        ("eliminar corte", eliminar_corte),
+        ("render Inventario", pestana("📦 Inventario")),
+        ("registrar venta", registrar_venta),
+        ("render Citas", pestana("📅 Citas")),
+        ("aceptar 10 citas", aceptar_citas),
+        ("render Finanzas", pestana("💵 Finanzas")),
+        ("insertar ingreso", insertar_ingreso),
+        ("render Reporte General", pestana("📊 Reporte General")),
+    ]
+
+
+def escenarios_clientes(at: AppTest) -> List[tuple]:
+    def reservar():
+        _por_etiqueta(at.text_input, "👤 Tu nombre completo").set_value("Bench")
+        return _por_etiqueta(at.button, "📥 Reservar cita").click().run()
+
+    return [
+        ("render agenda (arranque)", at.run),
+        ("render agenda (rerun)", at.run),
+        ("reservar cita", reservar),
+    ]
+
+
+def correr(filas: int, latencia: float, memoria: bool) -> List[Dict[str, Any]]:
+    resultados = []
+    for ruta, escenarios in (("app.py", escenarios_admin), ("clientes_app.py", escenarios_clientes)):
+        # Cada app arranca en frío: sin recursos compartidos de la corrida anterior
+        st.cache_resource.clear()
+        st.cache_data.clear()
+        cliente = ClienteFalso(latencia)
+        instalar(cliente)
+        sembrar(cliente, filas)
+        at = _nueva_app(ruta)
+        for operacion, fn in escenarios(at):
+            r = _medir(cliente, memoria, lambda: fn() or at)
+            resultados.append({"app": ruta, "filas": filas, "operacion": operacion, **r})
+            print(f"  {ruta:<16} {filas:>7} {operacion:<26} {r['llamadas']:>4} llamadas "
+                  f"{r['segundos']:>8.3f} s {r['pico_mb']:>8.1f} MB {r['error']}", flush=True)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de app.py y clientes_app.py contra una hoja en memoria.")
+    parser.add_argument("--filas", type=int, nargs="+", default=TAMANOS, help="tamaños de hoja a medir")
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos de espera por llamada a la API")
+    parser.add_argument("--sin-memoria", action="store_true", help="no medir el pico de memoria (tiempos sin tracemalloc)")
+    parser.add_argument("--salida", help="guarda los resultados en CSV")
+    args = parser.parse_args()
+
+    # Backend Sheets y cuota sin tope: se mide la app, no el gobernador
+    os.environ["BARBERIA_STORAGE_BACKEND"] = "sheets"
+    os.environ["BARBERIA_SHEETS_LECTURAS_POR_MINUTO"] = "1000000"
+    os.environ["BARBERIA_SHEETS_ESCRITURAS_POR_MINUTO"] = "1000000"
+
+    resultados = []
+    for filas in args.filas:
+        print(f"⏱️ {filas} filas", flush=True)
+        resultados += correr(filas, args.latencia, not args.sin_memoria)
+
+    df = pd.DataFrame(resultados)
+    print()
+    print(df.drop(columns=["detalle"]).to_string(index=False))
+    if args.salida:
+        df.to_csv(args.salida, index=False)
+        print(f"\n💾 Resultados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
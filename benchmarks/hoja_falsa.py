@@ -0,0 +1,169 @@
+# ---------------------------------------------
+# 🧪 Hoja de cálculo falsa para benchmarks
+# benchmarks/hoja_falsa.py – Spreadsheet/Worksheet en memoria
+# ---------------------------------------------
+# Imita la parte de gspread que usan app.py y clientes_app.py: las celdas se
+# guardan como texto (igual que las devuelve Sheets con get_all_values), cada
+# llamada a la "API" se cuenta por método y puede esperar una latencia fija
+# para simular la red. `instalar()` reemplaza gspread.service_account_from_dict,
+# que es de donde sacan el cliente los `_gc()` de ambas apps.
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import gspread
+from gspread.utils import a1_range_to_grid_range, a1_to_rowcol
+
+
+def _texto(v: Any) -> str:
+    """Como USER_ENTERED: un apóstrofo inicial fuerza texto y no se guarda."""
+    v = str(v)
+    return v[1:] if v.startswith("'") else v
+
+
+class ClienteFalso:
+    """Cliente gspread en memoria: un solo libro, contador de llamadas y latencia por llamada."""
+
+    def __init__(self, latencia: float = 0.0):
+        self.latencia = latencia
+        self.llamadas: Counter = Counter()
+        self._lock = threading.Lock()
+        self.libro = LibroFalso(self)
+
+    def _api(self, metodo: str):
+        with self._lock:
+            self.llamadas[metodo] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(self.llamadas.values())
+
+    def reiniciar(self):
+        with self._lock:
+            self.llamadas.clear()
+
+    def open_by_url(self, url: str) -> "LibroFalso":
+        self._api("open_by_url")
+        return self.libro
+
+
+class LibroFalso:
+    title = "Barbería (benchmark)"
+
+    def __init__(self, cliente: ClienteFalso):
+        self._cliente = cliente
+        self.hojas: Dict[str, HojaFalsa] = {}
+        self.version = 0  # sube con cada escritura: hace de modifiedTime de Drive
+
+    def cargar(self, titulo: str, filas: List[List[Any]]):
+        """Reemplaza el contenido de una hoja (fila 0 = cabeceras) sin contar llamadas."""
+        self.hojas[titulo] = HojaFalsa(self, titulo, [[str(v) for v in fila] for fila in filas])
+
+    def worksheet(self, titulo: str) -> "HojaFalsa":
+        self._cliente._api("worksheet")
+        if titulo not in self.hojas:
+            raise gspread.WorksheetNotFound(titulo)
+        return self.hojas[titulo]
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26) -> "HojaFalsa":
+        self._cliente._api("add_worksheet")
+        self.hojas[title] = HojaFalsa(self, title, [])
+        self.version += 1
+        return self.hojas[title]
+
+    def get_lastUpdateTime(self) -> str:
+        self._cliente._api("get_lastUpdateTime")
+        return str(self.version)
+
+
+class HojaFalsa:
+    def __init__(self, libro: LibroFalso, titulo: str, datos: List[List[str]]):
+        self._libro = libro
+        self.title = titulo
+        self.id = abs(hash(titulo)) % 100000
+        self.datos = datos
+
+    def _api(self, metodo: str, escritura: bool = False):
+        self._libro._cliente._api(metodo)
+        if escritura:
+            self._libro.version += 1
+
+    def _poner(self, fila: int, col: int, valor: Any):
+        while len(self.datos) < fila:
+            self.datos.append([])
+        celdas = self.datos[fila - 1]
+        while len(celdas) < col:
+            celdas.append("")
+        celdas[col - 1] = _texto(valor)
+
+    def _escribir(self, rango: str, valores: List[List[Any]]):
+        fila0, col0 = a1_to_rowcol(rango.split("!")[-1].split(":")[0])
+        for i, fila in enumerate(valores):
+            for j, v in enumerate(fila):
+                self._poner(fila0 + i, col0 + j, v)
+
+    # ---- Lecturas ----
+    def get_all_values(self, **kwargs) -> List[List[str]]:
+        self._api("get_all_values")
+        ancho = max((len(f) for f in self.datos), default=0)
+        return [list(f) + [""] * (ancho - len(f)) for f in self.datos]
+
+    def row_values(self, fila: int, **kwargs) -> List[str]:
+        self._api("row_values")
+        return list(self.datos[fila - 1]) if len(self.datos) >= fila else []
+
+    def col_values(self, col: int, **kwargs) -> List[str]:
+        self._api("col_values")
+        return [f[col - 1] if len(f) >= col else "" for f in self.datos]
+
+    def get(self, rango: str, **kwargs) -> List[List[str]]:
+        self._api("get")
+        return self._leer(rango)
+
+    def _leer(self, rango: str) -> List[List[str]]:
+        g = a1_range_to_grid_range(rango.split("!")[-1])
+        filas = self.datos[g.get("startRowIndex", 0):g.get("endRowIndex", len(self.datos))]
+        return [f[g.get("startColumnIndex", 0):g.get("endColumnIndex", len(f))] for f in filas]
+
+    def batch_get(self, rangos: List[str], **kwargs) -> List[List[List[str]]]:
+        self._api("batch_get")
+        return [self._leer(r) for r in rangos]
+
+    # ---- Escrituras ----
+    def append_row(self, fila: List[Any], **kwargs):
+        return self.append_rows([fila], **kwargs)
+
+    def append_rows(self, filas: List[List[Any]], **kwargs):
+        self._api("append_rows", escritura=True)
+        inicio = len(self.datos) + 1
+        self.datos.extend([_texto(v) for v in f] for f in filas)
+        return {"updates": {"updatedRange": f"{self.title}!A{inicio}:Z{len(self.datos)}"}}
+
+    def insert_row(self, fila: List[Any], index: int = 1, **kwargs):
+        self._api("insert_row", escritura=True)
+        self.datos.insert(index - 1, [_texto(v) for v in fila])
+
+    def delete_rows(self, inicio: int, fin: Optional[int] = None):
+        self._api("delete_rows", escritura=True)
+        del self.datos[inicio - 1:(fin or inicio)]
+
+    def update_cell(self, fila: int, col: int, valor: Any):
+        self._api("update_cell", escritura=True)
+        self._poner(fila, col, valor)
+
+    def update(self, rango: str, values: Optional[List[List[Any]]] = None, **kwargs):
+        self._api("update", escritura=True)
+        self._escribir(rango, values or [])
+
+    def batch_update(self, data: List[Dict[str, Any]], **kwargs):
+        self._api("batch_update", escritura=True)
+        for d in data:
+            self._escribir(d["range"], d["values"])
+
+
+def instalar(cliente: ClienteFalso):
+    """Hace que gspread.service_account_from_dict devuelva el cliente falso."""
+    gspread.service_account_from_dict = lambda info, **kwargs: cliente
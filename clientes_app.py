@@ -3,10 +3,17 @@
 # clientes_app.py – Backend Google Sheets incluido
 # ---------------------------------------------
 import streamlit as st
+import re
+import threading
+import time
 from datetime import datetime, timedelta, date
 import pandas as pd
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 import gspread
+from storage import Storage, abrir_storage, leer_config
+from ids import GeneradorIds
+from gobernador import Gobernada, Gobernador
+from vigilante import VigilanteHoja
 
 st.set_page_config(page_title="Agendar Cita - Barbería", layout="centered")
 st.title("💈 Agenda tu cita")
@@ -19,9 +26,17 @@ SCHEMA_CITAS = ["id", "fecha", "hora", "cliente_nombre", "barbero", "servicio",
 HORARIO_INICIO = 8   # 8:00 am
 HORARIO_FIN = 19     # 7:00 pm (exclusivo)
 INTERVALO_MINUTOS = 30
+OCUPACION_TTL_SEGUNDOS = 60   # refresco del índice si Drive no responde
+OCUPACION_TTL_VIGILADO_SEGUNDOS = 600  # respaldo con Drive al día (ver escritura_propia)
+VIGILANTE_INTERVALO_SEGUNDOS = 15  # cada cuánto se pregunta a Drive si la hoja cambió
 SERVICIOS = ["Corte clásico", "Corte moderno", "Barba", "Color", "Combo completo"]
 
 # ====== Backend Sheets (robusto a hojas vacías) ======
+@st.cache_resource(show_spinner=False)
+def _storage() -> Optional[Storage]:
+    """Backend configurado (st.secrets['storage_backend']); None = Google Sheets."""
+    return abrir_storage({"Citas": SCHEMA_CITAS})
+
 @st.cache_resource(show_spinner=False)
 def _gc():
     sa = st.secrets.get("gcp_service_account")
@@ -29,11 +44,22 @@ def _gc():
         raise RuntimeError("Falta st.secrets['gcp_service_account']. Sube tu JSON y comparte la hoja con ese correo (Editor).")
     return gspread.service_account_from_dict(dict(sa))
 
+@st.cache_resource(show_spinner=False)
+def _gobernador() -> Gobernador:
+    """Cuota, reintentos y coalescencia para todas las llamadas del proceso (ver gobernador.py)."""
+    return Gobernador(
+        lecturas_por_minuto=float(leer_config("sheets_lecturas_por_minuto", "60")),
+        escrituras_por_minuto=float(leer_config("sheets_escrituras_por_minuto", "60")),
+    )
+
 @st.cache_resource(show_spinner=False)
 def _open_sheet():
-    return _gc().open_by_url(SPREADSHEET_URL)
+    # Envuelto: la hoja y las pestañas que se abran desde aquí pasan por el gobernador
+    return Gobernada(_gc(), _gobernador()).open_by_url(SPREADSHEET_URL)
 
+@st.cache_resource(show_spinner=False)
 def _get_ws():
+    """Abre/crea la hoja Citas y valida cabeceras una sola vez por proceso."""
     sh = _open_sheet()
     try:
         ws = sh.worksheet("Citas")
@@ -51,29 +77,103 @@ def _get_ws():
         ws.insert_row(SCHEMA_CITAS, 1)
     return ws
 
-def _next_id(ws) -> int:
-    ids = ws.col_values(1)[1:]
-    nums = []
-    for v in ids:
-        try:
-            nums.append(int(str(v).strip()))
-        except:
-            pass
-    return (max(nums) + 1) if nums else 1
+@st.cache_resource
+def _ids() -> GeneradorIds:
+    """Generador de ids del proceso (ver ids.py): sin leer la hoja en cada reserva."""
+    nodo = leer_config("id_nodo", "").strip()
+    return GeneradorIds(int(nodo) if nodo else None)
 
 def obtener_citas() -> List[Dict[str, Any]]:
+    if _storage() is not None:
+        return _storage().read_all("Citas")
     ws = _get_ws()
-    all_vals = ws.get_all_values()
-    if not all_vals or len(all_vals) == 1:
+    valores = ws.get_all_values()
+    if not valores or [h.strip() for h in valores[0]] != SCHEMA_CITAS:
+        # Cabeceras alteradas desde la validación: revalida el handle
+        _get_ws.clear()
+        ws = _get_ws()
+        valores = ws.get_all_values()
+    return _registros(valores)
+
+def _registros(valores: List[List[str]]) -> List[Dict[str, Any]]:
+    """Arma los registros desde la cuadrícula (fila 1 = cabeceras) sin volver a descargarla."""
+    if not valores or len(valores) == 1:
         return []
-    return ws.get_all_records()
+    headers = [h.strip() for h in valores[0]]
+    df = pd.DataFrame(valores[1:], columns=headers, dtype=object)
+    df = df.loc[:, [h != "" for h in headers]]
+    if "id" in df.columns:
+        ids = pd.to_numeric(df["id"].astype(str).str.strip(), errors="coerce")
+        ok = ids.notna() & (ids % 1 == 0)
+        df.loc[ok, "id"] = ids[ok].astype("int64")
+    return df.to_dict(orient="records")
 
-def insertar_cita(fecha: str, hora: str, cliente_nombre: str, barbero: str, servicio: str):
-    ws = _get_ws()
-    ws.append_row(
-        [_next_id(ws), fecha, hora, cliente_nombre, barbero, servicio, "pendiente"],
-        value_input_option="USER_ENTERED"
+def insertar_cita(fecha: str, hora: str, cliente_nombre: str, barbero: str, servicio: str) -> bool:
+    """Reserva el horario de forma atómica. Devuelve False si otra reserva lo tomó primero.
+
+    1) Se aparta el horario en el índice de ocupación (bajo su lock, sin releer la hoja).
+    2) Se escribe la cita.
+    3) Se confirma: si otra cita del mismo horario quedó antes (otra réplica/proceso
+       con el índice desfasado), gana la primera y la nuestra se borra.
+    """
+    hora = _norm_hhmm(hora)
+    # Lo que estaba en la hoja al armar el índice ya lo revisó _apartar
+    marca = _apartar(fecha, hora)
+    if marca is None:
+        return False
+    _id = _ids().siguiente()
+    try:
+        if _storage() is not None:
+            # La base rechaza el choque en la misma transacción que inserta
+            return _storage().append_si_libre("Citas", {
+                "id": _id, "fecha": fecha, "hora": hora, "cliente_nombre": cliente_nombre,
+                "barbero": barbero, "servicio": servicio, "estado": "pendiente"
+            }, ("fecha", "hora"))
+        ws = _get_ws()
+        # La reserva ya está en el índice (_apartar): no hace falta reconstruirlo por ella
+        with _vigilante().escritura_propia():
+            # El id va como texto para que la hoja no lo muestre en notación científica
+            respuesta = ws.append_row(
+                [f"'{_id}", fecha, hora, cliente_nombre, barbero, servicio, "pendiente"],
+                value_input_option="USER_ENTERED"
+            )
+            return _confirmar_en_hoja(ws, respuesta, _id, fecha, hora, marca)
+    except Exception:
+        _liberar(fecha, hora)
+        raise
+
+def _confirmar_en_hoja(ws, respuesta: Any, _id: int, fecha: str, hora: str,
+                      marca: Tuple[int, Optional[str]]) -> bool:
+    """Relee id/fecha/hora de las filas agregadas después del índice hasta la nuestra: gana la primera del horario.
+
+    `marca` = (filas, ancla) del índice de ocupación que revisó _apartar: lo
+    anterior ya estaba ahí, así que se lee desde la fila del ancla (la última
+    de entonces) hasta la nuestra. Si el ancla ya no está en su fila es que se
+    borraron filas arriba y todo se corrió: se relee desde la fila 2.
+    """
+    filas, ancla = marca
+    rango = str((respuesta or {}).get("updates", {}).get("updatedRange", ""))
+    fin = re.search(r"![A-Z]+(\d+)", rango)
+    hasta = fin.group(1) if fin else ""
+    desde, valores = 2, None
+    if ancla is not None and (not fin or filas < int(hasta)):
+        tramo = ws.get(f"A{filas}:C{hasta}")
+        if tramo and str(tramo[0][0] if tramo[0] else "").strip() == ancla:
+            desde, valores = filas + 1, tramo[1:]
+    if valores is None:
+        valores = ws.get(f"A2:C{hasta}")
+    df = pd.DataFrame([(list(v) + ["", "", ""])[:3] for v in valores], columns=["id", "fecha", "hora"], dtype=object)
+    propia = df.index[df["id"].astype(str).str.strip() == str(_id)]
+    if propia.empty:
+        return True
+    antes = df.loc[:propia[0] - 1]
+    choca = (_fechas(antes["fecha"]).dt.date == date.fromisoformat(fecha)) & (
+        _norm_hhmm_serie(antes["hora"]) == hora
     )
+    if choca.any():
+        ws.delete_rows(desde + int(propia[0]))
+        return False
+    return True
 
 # ====== Utilidad: normalizar hora a HH:MM ======
 def _norm_hhmm(x: str) -> str:
@@ -90,28 +190,134 @@ def _norm_hhmm(x: str) -> str:
         except Exception:
             return x
 
+def _norm_hhmm_serie(horas: pd.Series) -> pd.Series:
+    """_norm_hhmm para una columna: regex vectorizada y _norm_hhmm solo para lo raro."""
+    texto = horas.astype(str).str.strip()
+    partes = texto.str.extract(r"^(\d{1,2}):(\d{1,2})(?::\d{1,2})?$")
+    ok = partes[0].notna()
+    norm = texto.copy()
+    norm[ok] = partes.loc[ok, 0].str.zfill(2) + ":" + partes.loc[ok, 1].str.zfill(2)
+    norm[~ok] = texto[~ok].map(_norm_hhmm)
+    return norm
+
+def _fechas(valores: pd.Series) -> pd.Series:
+    """ISO vectorizado y, solo para lo que no calce (p. ej. 1/1/2030 de la hoja), formato libre."""
+    fechas = pd.to_datetime(valores, format="%Y-%m-%d", errors="coerce")
+    resto = fechas.isna() & valores.astype(str).str.strip().ne("")
+    if resto.any():
+        fechas[resto] = pd.to_datetime(valores[resto].astype(str), format="mixed", errors="coerce")
+    return fechas
+
+# ====== Índice de ocupación: fecha -> {HH:MM: estado} ======
+# Compartido entre sesiones y actualizado al reservar. Se reconstruye cuando el
+# vigilante ve que la hoja cambió en Drive (lo que acepta/rechaza el admin) y,
+# por si un cambio ajeno cayó durante una reserva propia, a más tardar cada
+# OCUPACION_TTL_VIGILADO_SEGUNDOS; si Drive no responde, cada OCUPACION_TTL_SEGUNDOS.
+@st.cache_resource(show_spinner=False)
+def _ocupacion() -> Dict[str, Any]:
+    # filas / ancla: filas de la hoja (con cabecera) e id de la última cuando se armó el índice
+    # locales: sube con cada reserva de este proceso (el vigilante no las cuenta)
+    return {"ts": None, "por_fecha": {}, "lock": threading.Lock(), "cambios": 0, "visto": 0,
+            "filas": 1, "ancla": None, "locales": 0}
+
+@st.cache_resource(show_spinner=False)
+def _vigilante() -> Optional[VigilanteHoja]:
+    """None con el backend SQLite (no hay Drive que consultar)."""
+    if _storage() is not None:
+        return None
+    occ = _ocupacion()
+
+    def al_cambiar():
+        # Solo cambios ajenos (ver escritura_propia). Sin tomar el lock: _vigente compara contadores y reconstruye en su turno
+        occ["cambios"] += 1
+
+    intervalo = float(leer_config("vigilante_segundos", str(VIGILANTE_INTERVALO_SEGUNDOS)))
+    vigilante = VigilanteHoja(_open_sheet().get_lastUpdateTime, al_cambiar, intervalo)
+    vigilante.iniciar()
+    return vigilante
+
+def _construir_ocupacion(citas: List[Dict[str, Any]]) -> Dict[date, Dict[str, str]]:
+    df = pd.DataFrame(citas)
+    if df.empty or not {"fecha", "hora", "estado"}.issubset(df.columns):
+        return {}
+    df["fecha"] = _fechas(df["fecha"]).dt.date
+    df["hora"] = _norm_hhmm_serie(df["hora"])  # 🔧 normaliza a HH:MM
+    df["estado"] = df["estado"].astype(str).replace("", "pendiente")
+    # Si hay varias citas en el mismo horario manda la primera
+    df = df.dropna(subset=["fecha"]).drop_duplicates(["fecha", "hora"], keep="first")
+    por_fecha: Dict[date, Dict[str, str]] = {}
+    for f, h, e in zip(df["fecha"], df["hora"], df["estado"]):
+        por_fecha.setdefault(f, {})[h] = e
+    return por_fecha
+
+def _vigente(occ: Dict[str, Any]) -> Dict[date, Dict[str, str]]:
+    """Índice al día (se llama con occ["lock"] tomado)."""
+    vigilante = _vigilante()
+    edad = time.monotonic() - occ["ts"] if occ["ts"] is not None else 0.0
+    if vigilante is not None and vigilante.activo():
+        vencido = occ["visto"] != occ["cambios"] or edad > OCUPACION_TTL_VIGILADO_SEGUNDOS
+    else:
+        vencido = edad > OCUPACION_TTL_SEGUNDOS
+    if occ["ts"] is None or vencido:
+        cambios = occ["cambios"]
+        citas = obtener_citas()
+        occ["por_fecha"] = _construir_ocupacion(citas)
+        occ["filas"] = len(citas) + 1
+        occ["ancla"] = (str(citas[-1].get("id", "")).strip() or None) if citas else None
+        occ["ts"], occ["visto"] = time.monotonic(), cambios
+    return occ["por_fecha"]
+
+def _horas_ocupadas(fecha: date) -> Dict[str, str]:
+    occ = _ocupacion()
+    with occ["lock"]:
+        return dict(_vigente(occ).get(fecha, {}))
+
+def _apartar(fecha: str, hora: str) -> Optional[Tuple[int, Optional[str]]]:
+    """Comprueba y marca el horario en un solo paso; None si ya estaba tomado.
+
+    Devuelve (filas, ancla) del índice que se revisó, tomados bajo el mismo lock:
+    si otra sesión lo reconstruye después, la confirmación igual lee desde aquí.
+    """
+    occ = _ocupacion()
+    with occ["lock"]:
+        horas = _vigente(occ).setdefault(date.fromisoformat(fecha), {})
+        if hora in horas:
+            return None
+        horas[hora] = "pendiente"
+        occ["locales"] += 1
+        return occ["filas"], occ["ancla"]
+
+def _liberar(fecha: str, hora: str):
+    """Deshace _apartar cuando la escritura falla."""
+    occ = _ocupacion()
+    with occ["lock"]:
+        occ["por_fecha"].get(date.fromisoformat(fecha), {}).pop(hora, None)
+        occ["locales"] += 1
+
+def _version_agenda() -> tuple:
+    """Cambios en Drive más reservas de este proceso: lo que otra sesión tiene que ver."""
+    return _vigilante().version, _ocupacion()["locales"]
+
 # ====== UI ======
 fecha = st.date_input("📅 Fecha", min_value=date.today())
 
-def generar_horarios_del_dia(fecha):
-    try:
-        citas = obtener_citas()
-        df = pd.DataFrame(citas)
+# Los horarios se refrescan solos cuando la hoja cambia (otra reserva o el admin)
+if _vigilante() is not None:
+    st.session_state["_version_vista"] = _version_agenda()
 
-        if not {"fecha", "hora", "estado"}.issubset(df.columns):
-            df = pd.DataFrame(columns=["fecha", "hora", "estado"])
+    @st.fragment(run_every=_vigilante().intervalo)
+    def _avisar_cambios():
+        if _version_agenda() != st.session_state.get("_version_vista"):
+            st.rerun()
 
-        if not df.empty:
-            df["fecha"] = pd.to_datetime(df["fecha"]).dt.date
-            df["hora"] = df["hora"].astype(str).map(_norm_hhmm)  # 🔧 normaliza a HH:MM
-        else:
-            df["fecha"] = pd.to_datetime(pd.Series(dtype="datetime64[ns]"))
-            df["hora"] = pd.Series(dtype=str)
-            df["estado"] = pd.Series(dtype=str)
+    _avisar_cambios()
 
+def generar_horarios_del_dia(fecha):
+    try:
+        ocupadas = _horas_ocupadas(fecha)
     except Exception as e:
         st.warning(f"⚠️ Error al procesar citas: {e}")
-        df = pd.DataFrame(columns=["fecha", "hora", "estado"])
+        ocupadas = {}
 
     horarios_dia = []
     actual = datetime.combine(fecha, datetime.min.time()).replace(hour=HORARIO_INICIO)
@@ -119,12 +325,7 @@ def generar_horarios_del_dia(fecha):
 
     while actual < fin:
         hora_str = actual.strftime("%H:%M")  # siempre HH:MM
-        estado = "disponible"
-
-        coincidencias = df[(df["fecha"] == fecha) & (df["hora"] == hora_str)]
-        if not coincidencias.empty:
-            estado = coincidencias.iloc[0]["estado"] or "pendiente"
-
+        estado = ocupadas.get(hora_str, "disponible")
         horarios_dia.append({"hora": hora_str, "estado": estado})
         actual += timedelta(minutes=INTERVALO_MINUTOS)
     return horarios_dia
@@ -158,8 +359,10 @@ if horas_disponibles:
         if not cliente_nombre.strip():
             st.warning("⚠️ Debes ingresar tu nombre.")
         else:
-            insertar_cita(str(fecha), hora, cliente_nombre.strip(), "", servicio)
-            st.success("✅ Cita registrada. Espera aprobación del administrador.")
-            st.rerun()
+            if insertar_cita(str(fecha), hora, cliente_nombre.strip(), "", servicio):
+                st.success("✅ Cita registrada. Espera aprobación del administrador.")
+                st.rerun()
+            else:
+                st.error("⛔ Ese horario acaba de ser reservado por otra persona. Elige otro horario.")
 else:
     st.warning("⛔ No hay horarios disponibles para esta fecha.")
@@ -0,0 +1,134 @@
+# ---------------------------------------------
+# ⚙️ Diagnóstico
+# diagnostico.py – conteo de llamadas, latencias y bytes por rerun
+# ---------------------------------------------
+# Con el diagnóstico pedido, cada rerun de la app abre una Medicion en el hilo
+# que ejecuta el script; si no, el rerun llama `apagar()` y medir/observar_api
+# no hacen nada.
+# Las funciones decoradas con @medir y las llamadas a la API que pasan por el
+# gobernador (ver observar_api) dejan ahí un evento; al final del rerun la app
+# muestra el resumen y, si se configuró, agrega una línea JSON a la traza.
+# Los eventos de otros hilos (vigilante, cola de escrituras) no se atribuyen a
+# ningún rerun. Un fragmento que se redibuja solo no pasa por el inicio del
+# script: abre su propia Medicion cuando la del rerun ya quedó cerrada.
+import functools
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+_hilo = threading.local()
+# tamano(): una lista de más de LISTA_LARGA elementos (filas) se estima con sus
+# últimos MUESTRA; las cortas (las celdas de una fila) se suman enteras
+LISTA_LARGA = 20
+MUESTRA = 5
+
+
+class Medicion:
+    """Eventos (tipo, nombre, segundos, bytes) de un rerun."""
+
+    def __init__(self, etiqueta: str = ""):
+        self.etiqueta = etiqueta
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self.eventos: List[Dict[str, Any]] = []
+        self.cerrada = False  # ya se mostró/volcó: lo que llegue después es de otro rerun
+        self._segundos: Optional[float] = None
+
+    def registrar(self, tipo: str, nombre: str, segundos: float, bytes_: int = 0):
+        self.eventos.append({"tipo": tipo, "nombre": nombre, "segundos": segundos, "bytes": bytes_})
+
+    def transcurrido(self) -> float:
+        if self._segundos is not None:
+            return self._segundos
+        return time.perf_counter() - self._t0
+
+    def cerrar(self):
+        """Fija la duración y marca el rerun como terminado."""
+        if not self.cerrada:
+            self._segundos = self.transcurrido()
+            self.cerrada = True
+
+    def resumen(self) -> List[Dict[str, Any]]:
+        """Eventos agrupados por (tipo, nombre): llamadas, segundos y bytes."""
+        grupos: Dict[tuple, Dict[str, Any]] = {}
+        for e in self.eventos:
+            g = grupos.setdefault((e["tipo"], e["nombre"]), {"tipo": e["tipo"], "nombre": e["nombre"], "llamadas": 0, "segundos": 0.0, "bytes": 0})
+            g["llamadas"] += 1
+            g["segundos"] += e["segundos"]
+            g["bytes"] += e["bytes"]
+        return sorted(grupos.values(), key=lambda g: -g["segundos"])
+
+    def volcar(self, ruta: str):
+        """Agrega el rerun como una línea JSON al archivo de traza."""
+        linea = {"inicio": self.inicio, "etiqueta": self.etiqueta, "segundos": self.transcurrido(), "eventos": self.eventos}
+        with open(ruta, "a", encoding="utf-8") as f:
+            f.write(json.dumps(linea, ensure_ascii=False, default=str) + "\n")
+
+
+def iniciar(etiqueta: str = "") -> Medicion:
+    """Abre la medición del rerun en curso (una por hilo de script)."""
+    _hilo.medicion = Medicion(etiqueta)
+    return _hilo.medicion
+
+
+def apagar():
+    """Rerun sin diagnóstico: descarta la medición que haya dejado un rerun anterior del hilo."""
+    _hilo.medicion = None
+
+
+def actual() -> Optional[Medicion]:
+    return getattr(_hilo, "medicion", None)
+
+
+def tamano(valor: Any) -> int:
+    """Bytes aproximados de una respuesta/carga (texto de las celdas).
+
+    Una lista larga se estima con el promedio de sus últimos elementos por su
+    largo: no se recorren todas las celdas de una hoja para medirla, y la
+    muestra son filas de datos (la primera suele ser la cabecera).
+    """
+    if valor is None:
+        return 0
+    if isinstance(valor, (bytes, bytearray)):
+        return len(valor)
+    if isinstance(valor, str):
+        return len(valor.encode("utf-8"))
+    if isinstance(valor, dict):
+        return sum(tamano(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        if len(valor) <= LISTA_LARGA:
+            return sum(tamano(v) for v in valor)
+        muestra = valor[-MUESTRA:]
+        return len(valor) * sum(tamano(v) for v in muestra) // MUESTRA
+    return len(str(valor))
+
+
+def medir(tipo: str, nombre: Optional[str] = None) -> Callable:
+    """Decorador: registra la duración de cada llamada.
+
+    Sin `nombre` fijo se usa el primer argumento si es texto (la hoja) o el de la función.
+    """
+    def decorador(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def envoltura(*args, **kwargs):
+            medicion = actual()
+            if medicion is None:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                etiqueta = nombre or (args[0] if args and isinstance(args[0], str) else fn.__name__)
+                medicion.registrar(tipo, etiqueta, time.perf_counter() - t0)
+        if hasattr(fn, "clear"):  # funciones con st.cache_*: conservar .clear()
+            envoltura.clear = fn.clear
+        return envoltura
+    return decorador
+
+
+def observar_api(metodo: str, segundos: float, args: tuple, resultado: Any):
+    """Observador para el gobernador: una llamada real a la API de Google."""
+    medicion = actual()
+    if medicion is not None:
+        medicion.registrar("api", metodo, segundos, tamano(resultado) + tamano(args))
@@ -0,0 +1,178 @@
+# ---------------------------------------------
+# 🚦 Gobernador de llamadas a Google Sheets
+# gobernador.py – cuota (token bucket), reintentos con backoff y coalescencia
+# ---------------------------------------------
+# Sheets limita a ~60 lecturas y ~60 escrituras por minuto por cuenta de
+# servicio. En vez de dejar que una ráfaga choque con el 429 y el admin vea el
+# traceback, cada llamada pasa por aquí:
+# · espera su ficha en el balde de su tipo (lectura/escritura), con lo que el
+#   ritmo se queda en el techo de la cuota sin pasarlo;
+# · si aun así Google responde 429/5xx (o falla la red) se reintenta con
+#   backoff exponencial y jitter; las escrituras solo con 429, que es el único
+#   caso en que seguro no se aplicaron;
+# · las lecturas de hoja completa idénticas que llegan mientras otra igual está
+#   en vuelo esperan ese resultado en lugar de pedirlo de nuevo.
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+# Método gspread -> balde. None = solo reintentos (Drive tiene su propia cuota).
+TIPOS = {
+    "open_by_url": "lectura", "worksheet": "lectura", "get": "lectura",
+    "get_all_values": "lectura", "get_all_records": "lectura",
+    "col_values": "lectura", "row_values": "lectura", "batch_get": "lectura",
+    "add_worksheet": "escritura", "append_row": "escritura", "append_rows": "escritura",
+    "batch_update": "escritura", "update": "escritura", "update_cell": "escritura",
+    "delete_rows": "escritura", "insert_row": "escritura",
+    "get_lastUpdateTime": None,
+}
+# Lecturas de hoja completa que se pueden compartir entre llamadas simultáneas
+COALESCIBLES = {"get_all_values", "get_all_records", "col_values", "row_values"}
+# Llamadas que devuelven un Spreadsheet/Worksheet (se devuelve envuelto)
+DEVUELVEN_HOJA = {"open_by_url", "worksheet", "add_worksheet"}
+
+
+def reintentable(e: Exception, escritura: bool = False) -> bool:
+    """Cuota/servidor (APIError con esos códigos) o fallos de red sin respuesta.
+
+    Con `escritura` solo el 429: tras un 5xx o un corte de red la escritura pudo
+    haberse aplicado, y repetirla duplicaría un append o borraría otra fila.
+    """
+    respuesta = getattr(e, "response", None)
+    codigo = getattr(respuesta, "status_code", None)
+    if escritura:
+        return codigo == 429
+    if codigo is not None:
+        return codigo in ESTADOS_REINTENTABLES
+    return isinstance(e, OSError)
+
+
+class Balde:
+    """Token bucket: `por_minuto` fichas que se reponen de forma continua."""
+
+    def __init__(self, por_minuto: float):
+        self.capacidad = float(por_minuto)
+        self.ritmo = por_minuto / 60.0
+        self.fichas = self.capacidad
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self) -> float:
+        """Bloquea hasta tener una ficha; devuelve los segundos esperados."""
+        esperado = 0.0
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self.fichas = min(self.capacidad, self.fichas + (ahora - self._t) * self.ritmo)
+                self._t = ahora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return esperado
+                falta = (1 - self.fichas) / self.ritmo
+            time.sleep(falta)
+            esperado += falta
+
+
+class _EnVuelo:
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class Gobernador:
+    """Punto único por el que pasan las llamadas a la API (ver `Gobernada`)."""
+
+    def __init__(self, lecturas_por_minuto: float = 60, escrituras_por_minuto: float = 60,
+                 max_intentos: int = 6, espera_base: float = 1.0, espera_maxima: float = 32.0,
+                 observador: Optional[Callable[[str, float, tuple, Any], None]] = None):
+        self.baldes = {"lectura": Balde(lecturas_por_minuto), "escritura": Balde(escrituras_por_minuto)}
+        self.max_intentos = max_intentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.llamadas = 0
+        self.reintentos = 0
+        self.coalescidas = 0
+        self.segundos_en_cola = 0.0
+        self.observador = observador  # (método, segundos, args, resultado) tras cada llamada exitosa
+        self._lock = threading.Lock()
+        self._en_vuelo: Dict[Tuple, _EnVuelo] = {}
+
+    def llamar(self, fn: Callable[..., Any], *args, tipo: Optional[str] = None, clave: Optional[Tuple] = None,
+               metodo: str = "", **kwargs) -> Any:
+        """Ejecuta fn(*args, **kwargs) respetando la cuota; `clave` habilita la coalescencia."""
+        if clave is None:
+            return self._con_reintentos(fn, args, kwargs, tipo, metodo)
+        with self._lock:
+            vuelo = self._en_vuelo.get(clave)
+            propio = vuelo is None
+            if propio:
+                vuelo = self._en_vuelo[clave] = _EnVuelo()
+            else:
+                self.coalescidas += 1
+        if not propio:
+            vuelo.listo.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+        try:
+            vuelo.resultado = self._con_reintentos(fn, args, kwargs, tipo, metodo)
+            return vuelo.resultado
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+            vuelo.listo.set()
+
+    def _con_reintentos(self, fn, args, kwargs, tipo, metodo):
+        for intento in range(self.max_intentos):
+            if tipo in self.baldes:
+                self.segundos_en_cola += self.baldes[tipo].tomar()
+            self.llamadas += 1
+            try:
+                t0 = time.perf_counter()
+                resultado = fn(*args, **kwargs)
+                if self.observador is not None:
+                    self.observador(metodo or getattr(fn, "__name__", ""), time.perf_counter() - t0, args, resultado)
+                return resultado
+            except Exception as e:
+                if not reintentable(e, escritura=tipo == "escritura") or intento == self.max_intentos - 1:
+                    raise
+                self.reintentos += 1
+                espera = min(self.espera_base * 2 ** intento, self.espera_maxima)
+                time.sleep(espera + random.uniform(0, espera / 2))
+
+
+class Gobernada:
+    """Envuelve un Spreadsheet/Worksheet de gspread: sus llamadas pasan por el gobernador.
+
+    Las hojas que devuelva (worksheet, add_worksheet) salen también envueltas;
+    los atributos que no son llamadas a la API (title, id...) pasan directo.
+    """
+
+    def __init__(self, objeto: Any, gobernador: Gobernador):
+        self._objeto = objeto
+        self._gobernador = gobernador
+
+    def __getattr__(self, nombre: str) -> Any:
+        atributo = getattr(self._objeto, nombre)
+        if nombre not in TIPOS or not callable(atributo):
+            return atributo
+
+        def llamada(*args, **kwargs):
+            titulo = getattr(self._objeto, "title", "")
+            clave = None
+            if nombre in COALESCIBLES:
+                clave = (titulo, nombre, args, tuple(sorted(kwargs.items())))
+            metodo = f"{titulo}.{nombre}" if titulo else nombre
+            resultado = self._gobernador.llamar(atributo, *args, tipo=TIPOS[nombre], clave=clave, metodo=metodo, **kwargs)
+            if nombre in DEVUELVEN_HOJA:
+                return Gobernada(resultado, self._gobernador)
+            return resultado
+
+        return llamada
@@ -0,0 +1,51 @@
+# ---------------------------------------------
+# 🔢 Generador de ids
+# ids.py – ids únicos generados en el proceso, sin leer la hoja
+# ---------------------------------------------
+# id = (milisegundos desde EPOCA_MS) << 12 | nodo << 7 | secuencia
+#
+# · 41 bits de tiempo (~69 años) + 12 bits = 53 bits: el id cabe exacto en un
+#   float64 y sobrevive a pandas y JSON. En Sheets las apps lo escriben como
+#   texto para que la hoja no lo muestre en notación científica.
+# · `nodo` (5 bits) separa procesos: fijarlo con `id_nodo` distinto por app o
+#   réplica lo hace libre de colisiones; si no se fija se elige al azar.
+# · La secuencia arranca al azar en la mitad baja de cada milisegundo y avanza
+#   dentro de él; al agotarse se pasa al milisegundo siguiente sin esperar.
+# Los ids crecen con el tiempo, por lo que ordenar por id sigue siendo ordenar
+# por antigüedad, y los ids chicos ya existentes (1, 2, 3...) no chocan.
+import random
+import threading
+import time
+from typing import List, Optional
+
+EPOCA_MS = 1735689600000  # 2025-01-01 00:00 UTC
+BITS_NODO = 5
+BITS_SECUENCIA = 7
+
+
+class GeneradorIds:
+    """Ids crecientes y únicos dentro del proceso (seguro entre sesiones/hilos)."""
+
+    def __init__(self, nodo: Optional[int] = None):
+        self.nodo = random.randrange(1 << BITS_NODO) if nodo is None else int(nodo) % (1 << BITS_NODO)
+        self._lock = threading.Lock()
+        self._ms = -1
+        self._secuencia = 0
+
+    def siguiente(self) -> int:
+        return self.bloque(1)[0]
+
+    def bloque(self, n: int) -> List[int]:
+        """n ids en orden creciente (para cargas masivas)."""
+        with self._lock:
+            return [self._uno() for _ in range(n)]
+
+    def _uno(self) -> int:
+        ahora = int(time.time() * 1000) - EPOCA_MS
+        if ahora > self._ms:
+            self._ms, self._secuencia = ahora, random.randrange(1 << (BITS_SECUENCIA - 1))
+        elif self._secuencia == 1 << BITS_SECUENCIA:
+            # Secuencia agotada (o reloj atrasado): se sigue en el ms siguiente
+            self._ms, self._secuencia = self._ms + 1, random.randrange(1 << (BITS_SECUENCIA - 1))
+        self._secuencia += 1
+        return (self._ms << (BITS_NODO + BITS_SECUENCIA)) | (self.nodo << BITS_SECUENCIA) | (self._secuencia - 1)
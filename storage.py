@@ -0,0 +1,186 @@
+# ---------------------------------------------
+# 🗄️ Backends de almacenamiento
+# storage.py – interfaz común + backend SQLite local
+# ---------------------------------------------
+# Google Sheets sigue siendo el backend por defecto (vive dentro de cada app).
+# Con `storage_backend = "sqlite"` en st.secrets (o BARBERIA_STORAGE_BACKEND en
+# el entorno) app.py y clientes_app.py leen y escriben en un archivo SQLite.
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Any, Optional, Protocol, Tuple
+
+COLUMNAS_NUMERICAS = ("precio", "precio_unitario", "monto", "stock", "cantidad")
+COLUMNAS_ENTERAS = ("producto_id",)
+
+
+def leer_config(clave: str, defecto: str) -> str:
+    """Variable de entorno BARBERIA_<CLAVE>, luego st.secrets[clave], luego el defecto."""
+    valor = os.environ.get(f"BARBERIA_{clave.upper()}")
+    if valor:
+        return valor
+    import streamlit as st
+    try:
+        return str(st.secrets.get(clave, defecto))
+    except FileNotFoundError:
+        return defecto
+
+
+class Storage(Protocol):
+    """Superficie CRUD que usan las apps; `sheet` es el nombre de la hoja/tabla."""
+
+    def read_all(self, sheet: str) -> List[Dict[str, Any]]: ...
+
+    def read_range(self, sheet: str, desde: str, hasta: str) -> List[Dict[str, Any]]: ...
+
+    def agregar(self, sheet: str, claves: Tuple[str, ...], monto: str,
+                desde: Optional[str] = None, hasta: Optional[str] = None) -> List[tuple]: ...
+
+    def append_many(self, sheet: str, lista: List[Dict[str, Any]]) -> None: ...
+
+    def update_many(self, sheet: str, cambios: Dict[int, Dict[str, Any]]) -> None: ...
+
+    def delete(self, sheet: str, _id: int) -> None: ...
+
+    def append_si_libre(self, sheet: str, values: Dict[str, Any], claves: Tuple[str, ...]) -> bool: ...
+
+    def version(self) -> int: ...
+
+
+def _q(nombre: str) -> str:
+    return f'"{nombre}"'
+
+
+def _valor(v: Any) -> Any:
+    """Convierte a tipos que acepta sqlite3 (fechas -> texto, numpy -> Python)."""
+    if v is None or isinstance(v, (int, float, str)):
+        return v
+    if hasattr(v, "item"):
+        return v.item()
+    return str(v)
+
+
+class SQLiteStorage:
+    """Una tabla por hoja, con las mismas columnas que SCHEMAS e índices en id y fecha."""
+
+    def __init__(self, path: str, schemas: Dict[str, List[str]]):
+        self.schemas = schemas
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._conn:
+            for sheet, schema in schemas.items():
+                cols = []
+                for k in schema:
+                    if k == "id":
+                        cols.append(f"{_q(k)} INTEGER PRIMARY KEY")
+                    elif k in COLUMNAS_ENTERAS:
+                        cols.append(f"{_q(k)} INTEGER")
+                    elif k in COLUMNAS_NUMERICAS:
+                        cols.append(f"{_q(k)} REAL")
+                    else:
+                        cols.append(f"{_q(k)} TEXT")
+                self._conn.execute(f'CREATE TABLE IF NOT EXISTS {_q(sheet)} ({", ".join(cols)})')
+                if "fecha" in schema:
+                    self._conn.execute(f'CREATE INDEX IF NOT EXISTS {_q("idx_" + sheet + "_fecha")} ON {_q(sheet)} ("fecha")')
+
+    def read_all(self, sheet: str) -> List[Dict[str, Any]]:
+        schema = self.schemas[sheet]
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {", ".join(map(_q, schema))} FROM {_q(sheet)} ORDER BY "id"'
+            ).fetchall()
+        return [{k: ("" if v is None else v) for k, v in zip(schema, row)} for row in rows]
+
+    def read_range(self, sheet: str, desde: str, hasta: str) -> List[Dict[str, Any]]:
+        """Filas con fecha (AAAA-MM-DD) entre desde y hasta, usando el índice de fecha."""
+        schema = self.schemas[sheet]
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {", ".join(map(_q, schema))} FROM {_q(sheet)} WHERE "fecha" BETWEEN ? AND ? ORDER BY "id"',
+                (desde, hasta),
+            ).fetchall()
+        return [{k: ("" if v is None else v) for k, v in zip(schema, row)} for row in rows]
+
+    def agregar(self, sheet: str, claves: Tuple[str, ...], monto: str,
+                desde: Optional[str] = None, hasta: Optional[str] = None) -> List[tuple]:
+        """(claves..., cantidad, suma de `monto`) por cada combinación de `claves`.
+
+        La suma la hace SQLite con GROUP BY: no se traen las filas. Las claves
+        salen como texto ('' si faltan); con desde/hasta, solo ese período.
+        """
+        cols = ", ".join(f"COALESCE(CAST({_q(k)} AS TEXT), '')" for k in claves)
+        sql = f"SELECT {cols}, COUNT(*), TOTAL({_q(monto)}) FROM {_q(sheet)}"
+        params: List[Any] = []
+        if desde is not None:
+            sql += ' WHERE "fecha" BETWEEN ? AND ?'
+            params = [desde, hasta]
+        sql += " GROUP BY " + ", ".join(str(i + 1) for i in range(len(claves)))
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def append_many(self, sheet: str, lista: List[Dict[str, Any]]) -> None:
+        schema = self.schemas[sheet]
+        sql = f'INSERT INTO {_q(sheet)} ({", ".join(map(_q, schema))}) VALUES ({", ".join("?" for _ in schema)})'
+        filas = [[_valor(values.get(k, None if k == "id" else "")) for k in schema] for values in lista]
+        with self._lock, self._conn:
+            self._conn.executemany(sql, filas)
+
+    def update_many(self, sheet: str, cambios: Dict[int, Dict[str, Any]]) -> None:
+        schema = self.schemas[sheet]
+        with self._lock, self._conn:
+            for _id, values in cambios.items():
+                cols = [k for k in values if k in schema and k != "id"]
+                if not cols:
+                    continue
+                self._conn.execute(
+                    f'UPDATE {_q(sheet)} SET {", ".join(f"{_q(k)} = ?" for k in cols)} WHERE "id" = ?',
+                    [_valor(values[k]) for k in cols] + [int(_id)],
+                )
+
+    def delete(self, sheet: str, _id: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(f'DELETE FROM {_q(sheet)} WHERE "id" = ?', (int(_id),))
+
+    def append_si_libre(self, sheet: str, values: Dict[str, Any], claves: Tuple[str, ...]) -> bool:
+        """Inserta la fila solo si ninguna otra tiene los mismos valores en `claves`.
+
+        Comprobación e inserción van en una transacción BEGIN IMMEDIATE: otro
+        proceso que reserve lo mismo espera el candado de escritura y ve la fila.
+        """
+        schema = self.schemas[sheet]
+        condicion = " AND ".join(f"{_q(k)} = ?" for k in claves)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tomado = self._conn.execute(
+                    f"SELECT 1 FROM {_q(sheet)} WHERE {condicion} LIMIT 1", [_valor(values[k]) for k in claves]
+                ).fetchone()
+                if tomado is None:
+                    self._conn.execute(
+                        f'INSERT INTO {_q(sheet)} ({", ".join(map(_q, schema))}) VALUES ({", ".join("?" for _ in schema)})',
+                        [_valor(values.get(k, None if k == "id" else "")) for k in schema],
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return tomado is None
+
+    def version(self) -> int:
+        """Cambia cuando otra conexión (otro proceso) confirma cambios en el archivo."""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+BACKENDS = {"sqlite": SQLiteStorage}
+
+
+def abrir_storage(schemas: Dict[str, List[str]]) -> Optional[Storage]:
+    """Backend configurado para las hojas dadas; None significa Google Sheets."""
+    nombre = leer_config("storage_backend", "sheets").strip().lower()
+    if nombre == "sheets":
+        return None
+    if nombre not in BACKENDS:
+        raise RuntimeError(f"Backend de almacenamiento desconocido: {nombre!r} (usa 'sheets' o 'sqlite').")
+    return BACKENDS[nombre](leer_config("sqlite_path", "barberia.db"), schemas)
@@ -0,0 +1,89 @@
+# ---------------------------------------------
+# 🔔 Vigilante de cambios
+# vigilante.py – hilo que detecta cambios en la hoja con la fecha de Drive
+# ---------------------------------------------
+# Consultar el `modifiedTime` de Drive cuesta una llamada liviana, mientras que
+# descargar las hojas cuesta una lectura por hoja. El vigilante pregunta cada
+# `intervalo` segundos y solo cuando la fecha cambia avisa a la app, que
+# descarta su copia en memoria y sube la versión para que las sesiones se
+# refresquen. Si Drive no responde, `activo()` pasa a False y las apps vuelven
+# a su TTL de siempre.
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+
+class VigilanteHoja:
+    """Sondea `leer_modificado()` y llama `al_cambiar()` cuando el valor cambia."""
+
+    def __init__(self, leer_modificado: Callable[[], str], al_cambiar: Callable[[], None], intervalo: float = 15.0):
+        self.leer_modificado = leer_modificado
+        self.al_cambiar = al_cambiar
+        self.intervalo = intervalo
+        self.version = 0            # sube cada vez que la hoja cambió
+        self.modificado: Optional[str] = None
+        self.ultimo_ok: Optional[float] = None
+        self.ultimo_error: Optional[str] = None
+        self._hilo: Optional[threading.Thread] = None
+
+    def activo(self) -> bool:
+        """True si el último sondeo fue reciente: la copia en memoria se puede dar por buena."""
+        return self.ultimo_ok is not None and time.monotonic() - self.ultimo_ok < 3 * self.intervalo
+
+    def revisar(self) -> bool:
+        """Un sondeo. Devuelve True si la hoja cambió desde el anterior."""
+        try:
+            modificado = self.leer_modificado()
+        except Exception as e:
+            self.ultimo_error = str(e)
+            return False
+        cambio = modificado != self.modificado
+        if cambio:
+            # También en el primer sondeo: lo que se haya leído antes no está garantizado
+            self.al_cambiar()
+            self.modificado = modificado
+            self.version += 1
+        self.ultimo_ok = time.monotonic()
+        self.ultimo_error = None
+        return cambio
+
+    @contextmanager
+    def escritura_propia(self) -> Iterator[None]:
+        """Envuelve una escritura de este proceso para que el sondeo no la tome por ajena.
+
+        Quien escribe ya actualizó su copia en memoria: si la fecha de Drive no
+        había cambiado antes de escribir, la de después se adopta sin llamar a
+        `al_cambiar`. Cuesta dos consultas livianas en vez de volver a bajar
+        todas las hojas. Lo que otro escriba justo mientras dura la nuestra
+        queda sin avisar hasta el próximo cambio; si Drive todavía no refleja
+        la escritura, el sondeo la verá como un cambio más y se descarta todo.
+        """
+        try:
+            antes = self.leer_modificado()
+        except Exception:
+            antes = None
+        yield
+        if antes is None or antes != self.modificado:
+            return  # hay un cambio sin avisar: que lo vea el sondeo
+        try:
+            despues = self.leer_modificado()
+        except Exception:
+            return
+        if self.modificado == antes:  # si el hilo sondeó en el medio, ya avisó
+            self.modificado = despues
+
+    def iniciar(self):
+        """Primer sondeo en el acto y luego el hilo en segundo plano."""
+        if self._hilo is None:
+            self.revisar()
+            self._hilo = threading.Thread(target=self._bucle, name="vigilante-hoja", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.revisar()
+            except Exception as e:  # nunca dejar morir al hilo
+                self.ultimo_error = str(e)
@@ -0,0 +1,151 @@
+# ---------------------------------------------
+# 📨 Cola de escrituras diferidas
+# write_queue.py – diario SQLite + hilo que sincroniza con Google Sheets
+# ---------------------------------------------
+# Las escrituras de la UI se guardan al instante en un diario local y un hilo
+# en segundo plano las envía a la hoja en lotes, en el mismo orden en que se
+# encolaron. Los errores de cuota (429) y de servidor (5xx) se reintentan con
+# backoff exponencial; el resto quedan marcados como error para revisarlos.
+# Un tramo que falló con 5xx o sin respuesta pudo haberse escrito igual: al
+# reenviarlo `aplicar` recibe reintento=True para no repetir lo que ya llegó.
+import json
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from gobernador import reintentable
+
+
+class WriteQueue:
+    """Diario durable de operaciones (append/update/delete) por hoja.
+
+    `aplicar(sheet, op, payloads, reintento)` recibe cada tramo consecutivo de
+    operaciones iguales sobre la misma hoja y debe escribirlo en una sola
+    llamada; `reintento` indica que parte del tramo pudo haberse escrito ya.
+    """
+
+    def __init__(self, path: str, aplicar: Callable[[str, str, List[Any], bool], None], tamano_lote: int = 200):
+        self.aplicar = aplicar
+        self.tamano_lote = tamano_lote
+        self.version = 0            # sube cada vez que se sincroniza un lote
+        self.sincronizadas = 0
+        self.ultima_sync: Optional[float] = None
+        self.ultimo_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._hay_trabajo = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ops ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, sheet TEXT, op TEXT, payload TEXT, "
+                "estado TEXT DEFAULT 'pendiente', error TEXT, creado REAL)"
+            )
+            # Lo pendiente de una corrida anterior pudo escribirse justo antes de cerrar
+            self._dudosos = {seq for (seq,) in self._conn.execute("SELECT seq FROM ops WHERE estado = 'pendiente'")}
+
+    # ---- lado de la UI ----
+    def encolar(self, sheet: str, op: str, payloads: List[Any]):
+        """Guarda las operaciones en el diario (una transacción) y despierta al hilo."""
+        ahora = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO ops (sheet, op, payload, creado) VALUES (?, ?, ?, ?)",
+                [(sheet, op, json.dumps(p, default=str), ahora) for p in payloads],
+            )
+        self._hay_trabajo.set()
+
+    def pendientes(self, sheet: str) -> List[Tuple[str, Any]]:
+        """(op, payload) aún no sincronizados de la hoja, en orden de llegada."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT op, payload FROM ops WHERE sheet = ? AND estado = 'pendiente' ORDER BY seq", (sheet,)
+            ).fetchall()
+        return [(op, json.loads(payload)) for op, payload in rows]
+
+    def estado(self) -> Dict[str, Any]:
+        with self._lock:
+            conteo = dict(self._conn.execute("SELECT estado, COUNT(*) FROM ops GROUP BY estado").fetchall())
+        return {
+            "pendientes": conteo.get("pendiente", 0),
+            "errores": conteo.get("error", 0),
+            "sincronizadas": self.sincronizadas,
+            "ultima_sync": self.ultima_sync,
+            "ultimo_error": self.ultimo_error,
+        }
+
+    def reintentar_errores(self):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE ops SET estado = 'pendiente', error = NULL WHERE estado = 'error'")
+        self._hay_trabajo.set()
+
+    # ---- hilo de sincronización ----
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="write-queue", daemon=True)
+            self._hilo.start()
+
+    def _tramos(self) -> List[Tuple[str, str, List[int], List[Any]]]:
+        """Lote pendiente agrupado en tramos consecutivos de (hoja, op)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, sheet, op, payload FROM ops WHERE estado = 'pendiente' ORDER BY seq LIMIT ?",
+                (self.tamano_lote,),
+            ).fetchall()
+        tramos: List[Tuple[str, str, List[int], List[Any]]] = []
+        for seq, sheet, op, payload in rows:
+            if tramos and tramos[-1][0] == sheet and tramos[-1][1] == op:
+                tramos[-1][2].append(seq)
+                tramos[-1][3].append(json.loads(payload))
+            else:
+                tramos.append((sheet, op, [seq], [json.loads(payload)]))
+        return tramos
+
+    def vaciar(self) -> bool:
+        """Sincroniza un lote. Devuelve False si hay que esperar (sin trabajo o error reintentable)."""
+        tramos = self._tramos()
+        if not tramos:
+            return False
+        for sheet, op, seqs, payloads in tramos:
+            marcas = ",".join("?" for _ in seqs)
+            try:
+                self.aplicar(sheet, op, payloads, any(s in self._dudosos for s in seqs))
+            except Exception as e:
+                self.ultimo_error = f"{sheet}/{op}: {e}"
+                if reintentable(e):
+                    self._dudosos.update(seqs)
+                    return False
+                with self._lock, self._conn:
+                    self._conn.execute(
+                        f"UPDATE ops SET estado = 'error', error = ? WHERE seq IN ({marcas})", [str(e)] + seqs
+                    )
+                continue
+            with self._lock, self._conn:
+                self._conn.execute(f"DELETE FROM ops WHERE seq IN ({marcas})", seqs)
+            self._dudosos.difference_update(seqs)
+            self.sincronizadas += len(seqs)
+            self.ultima_sync = time.time()
+            self.version += 1
+        return True
+
+    def _bucle(self):
+        espera = 1.0
+        while True:
+            try:
+                avanzo = self.vaciar()
+            except Exception as e:  # nunca dejar morir al hilo
+                self.ultimo_error = str(e)
+                avanzo = False
+            if avanzo:
+                espera = 1.0
+                continue
+            if self.estado()["pendientes"]:
+                # Backoff exponencial con jitter mientras la hoja rechace escrituras
+                time.sleep(espera + random.uniform(0, espera / 2))
+                espera = min(espera * 2, 60.0)
+            else:
+                self._hay_trabajo.wait(timeout=5)
+                self._hay_trabajo.clear()